@@ -0,0 +1,242 @@
+"""
+Autopilot: a controller that steers the snake to the nearest food by itself, for demos and load tests.
+
+It plans a path through the cube with A* over the grid's cells, from the head to the food closest to it
+(by Manhattan distance, which is also the heuristic), and follows it from tick to tick. The path is only planned
+again when the target food is gone, when the next cell of the path is no longer free, or when the head left the
+path; a cell filled elsewhere in the world costs nothing. A search that finds no way to the food leaves behind
+the closed region it ran through, and the food isn't searched for again while that region stays closed.
+When no food can be reached, it moves to the free neighbour with the most free neighbours, to stay alive
+for as long as it can.
+
+The snake can only move within its plane, so every step of the path is turned into the commands of
+steering.Controller: change_direction, after change_orientation when the step goes along the depth axis.
+"""
+import heapq
+from collections import deque
+import numpy as np
+from model import ORIENTATIONS, STEPS, TURNS, OPPOSITES, EMPTY, FOOD
+from steering import Controller, DIRECTIONS
+NEIGHBOURS = [(1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)]
+# For every orientation and unit vector, the (turn or None, direction) pairs of commands moving the snake along it,
+# the ones that don't turn the plane first
+COMMANDS = [dict((vector, [(turn, direction) for turn in [None] + DIRECTIONS for direction in DIRECTIONS
+	if STEPS[orientation if turn is None else TURNS[turn][orientation]][direction] == vector]) for vector in NEIGHBOURS)
+	for orientation in range(len(ORIENTATIONS))]
+
+
+def free(kind):
+	"""Return whether the head can move into a cell of a kind"""
+	return kind == EMPTY or kind == FOOD
+
+
+class Enclosure(object):
+	"""
+	A closed region of free cells, found by a search that ran out of cells: nothing inside it can reach anything
+	outside, so it separates the food and the head when one of them is in it and the other isn't.
+
+	Cells of the region that fill up later stay in it, so that it only grows. When cells of its boundary empty,
+	the region takes them in, unless they touch free cells outside of it, which opens it.
+	"""
+	def __init__(self, grid, region, boundary):
+		self.grid = grid
+		self.region = region
+		self.boundary = boundary
+		self.boundary_cells = None		# The boundary as an array, for checking it in one lookup
+
+	def separates(self, a, b):
+		return (a in self.region) != (b in self.region)
+
+	def still_closed(self):
+		"""Take in the boundary cells that emptied since the last call. Return False if the region opened"""
+		if self.boundary_cells is None:
+			self.boundary_cells = np.array(sorted(self.boundary), dtype=np.intp).reshape(-1, 3)
+		kinds = self.grid.kinds()[tuple(self.boundary_cells.T)]
+		emptied = self.boundary_cells[(kinds == EMPTY) | (kinds == FOOD)]
+		if not len(emptied):
+			return True
+		for cell in map(tuple, emptied.tolist()):
+			self.boundary.discard(cell)
+			self.region.add(cell)
+		for cell in map(tuple, emptied.tolist()):
+			for neighbour in neighbours(cell, self.grid.dimensions):
+				if neighbour in self.region or neighbour in self.boundary:
+					continue
+				if free(self.grid.kind_at(neighbour)):
+					return False
+				self.boundary.add(neighbour)
+		self.boundary_cells = None
+		return True
+
+
+def neighbours(position, dimensions):
+	"""Return the positions next to a cell that are inside the cube"""
+	x, y, z = position
+	return [(x + dx, y + dy, z + dz) for dx, dy, dz in NEIGHBOURS
+		if 0 <= x + dx < dimensions and 0 <= y + dy < dimensions and 0 <= z + dz < dimensions]
+
+
+class PathPlanner(object):
+	"""
+	Finds and caches paths from the head of a snake to food.
+
+	Data:
+		path: list of the positions left to go through, the next one last, or None if there is no plan.
+		target: position of the food the path leads to.
+		enclosures: Enclosures found by searches that ran out of cells, kept while they stay closed, so that food
+			known to be out of reach isn't searched for again every tick.
+		given_up: foods whose search ran out of expansions, not searched for again until the foods change.
+		plans: number of searches run, to see how often the cached results are reused.
+	"""
+	def __init__(self, model, max_expansions=200000):
+		self.model = model
+		self.max_expansions = max_expansions
+		self.path = None
+		self.target = None
+		self.grid = None
+		self.enclosures = []
+		self.given_up = set()
+		self.foods = frozenset()
+		self.plans = 0
+
+	def next_step(self):
+		"""Return the position the head should move to next, or None if it has nowhere to go"""
+		grid, head = self.model.grid, self.model.snake.head_position
+		if grid is not self.grid:
+			self.grid, self.enclosures, self.given_up, self.path = grid, [], set(), None
+		self.enclosures = [enclosure for enclosure in self.enclosures if enclosure.still_closed()]
+		if (self.path is None or self.target not in self.model.foods or not self.path
+				or sum(abs(a - b) for a, b in zip(self.path[-1], head)) != 1 or not free(grid.kind_at(self.path[-1]))):
+			self.plan()
+		if self.path:
+			return self.path.pop()
+		return self.escape()
+
+	def plan(self):
+		"""
+		Search for a path from the head to the nearest food not known to be out of reach. Leave path None if there
+		is none. The search from the head runs alongside a search of the cells around the food, so that food walled
+		in is found out in as many steps as there are cells in its pocket. A search that runs out of cells leaves
+		an Enclosure behind, and the next nearest food is searched for on the next tick.
+		"""
+		self.path = None
+		head = self.model.snake.head_position
+		foods = frozenset(self.model.foods)
+		if foods != self.foods:
+			self.foods, self.given_up = foods, set()
+		candidates = [food for food in foods if food not in self.given_up
+			and not any(enclosure.separates(head, food) for enclosure in self.enclosures)]
+		if not candidates:
+			return
+		self.plans += 1
+		self.target = min(candidates, key=lambda food: sum(abs(a - b) for a, b in zip(food, head)))
+		result = {}
+		searches = [self.search_path(head, self.target, result), self.search_pocket(self.target, head, result)]
+		expansions = 0
+		while not result and searches and expansions < self.max_expansions:
+			for search in list(searches):
+				if next(search, False) is False:
+					searches.remove(search)
+			expansions += 1
+		if 'path' in result:
+			self.path = result['path']
+		elif 'enclosure' in result:
+			self.enclosures.append(result['enclosure'])
+		else:
+			self.given_up.add(self.target)
+
+	def search_path(self, head, goal, result):
+		"""
+		A* from the head to the goal, yielding True after every expansion. Put the path in result['path'],
+		or an Enclosure of the cells reached in result['enclosure'] if the goal can't be reached
+		"""
+		grid = self.model.grid
+		cells, dimensions = grid.kinds(), grid.dimensions
+
+		def distance(position):
+			return abs(position[0] - goal[0]) + abs(position[1] - goal[1]) + abs(position[2] - goal[2])
+
+		# Entries are (estimated length, -length so far, position): ties go to the deepest node, so that
+		# in open space only the cells along one shortest path are expanded
+		queue = [(distance(head), 0, head)]
+		came_from = {head: None}
+		blocked = set()
+		while queue:
+			estimate, negative_length, position = heapq.heappop(queue)
+			if position == goal:
+				path = []
+				while position != head:
+					path.append(position)
+					position = came_from[position]
+				result['path'] = path
+				return
+			for neighbour in neighbours(position, dimensions):
+				if neighbour in came_from or neighbour in blocked:
+					continue
+				if not free(cells[neighbour]):
+					blocked.add(neighbour)
+					continue
+				came_from[neighbour] = position
+				heapq.heappush(queue, (distance(neighbour) - negative_length + 1, negative_length - 1, neighbour))
+			yield True
+		result['enclosure'] = Enclosure(grid, set(came_from), blocked)
+
+	def search_pocket(self, food, head, result):
+		"""
+		Breadth-first search of the free cells connected to a food, yielding True after every expansion.
+		Put an Enclosure of them in result['enclosure'] if they don't lead to the head; stop if they do
+		"""
+		grid = self.model.grid
+		cells, dimensions = grid.kinds(), grid.dimensions
+		seen, blocked = set([food]), set()
+		queue = deque([food])
+		while queue:
+			for neighbour in neighbours(queue.popleft(), dimensions):
+				if neighbour == head:
+					return
+				if neighbour in seen or neighbour in blocked:
+					continue
+				if not free(cells[neighbour]):
+					blocked.add(neighbour)
+					continue
+				seen.add(neighbour)
+				queue.append(neighbour)
+			yield True
+		result['enclosure'] = Enclosure(grid, seen, blocked)
+
+	def escape(self):
+		"""Return the free neighbour of the head with the most free neighbours itself, or None if there is none"""
+		grid, head = self.model.grid, self.model.snake.head_position
+
+		def free_neighbours(position):
+			return [neighbour for neighbour in neighbours(position, grid.dimensions) if free(grid.kind_at(neighbour))]
+		options = free_neighbours(head)
+		if not options:
+			return None
+		return max(options, key=lambda option: len(free_neighbours(option)))
+
+
+class AIController(Controller):
+	"""
+	Steers the snake along the paths of a PathPlanner: every tick, act turns the plane if needed and sets
+	the direction of the snake so that its next move is the next step of the path
+	"""
+	def __init__(self, model, max_expansions=200000):
+		super(AIController, self).__init__(model)
+		self.planner = PathPlanner(model, max_expansions)
+
+	def act(self, tick=None):
+		snake = self.model.snake
+		if snake.dead:
+			return
+		step = self.planner.next_step()
+		if step is None:
+			return
+		vector = tuple(a - b for a, b in zip(step, snake.head_position))
+		for turn, direction in COMMANDS[self.model.plane.orientation][vector]:
+			if len(snake) == 1 or direction != OPPOSITES[snake.direction]:
+				if turn is not None:
+					self.change_orientation(turn)
+				self.change_direction(direction)
+				return
+		self.planner.path = None		# No way to make that move: plan again from wherever the snake goes
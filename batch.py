@@ -0,0 +1,252 @@
+"""
+Many games advanced at once with array operations, for training bots.
+
+The state of K games is stored as stacked arrays, and every tick is a fixed set of array operations over
+all of them, following the same rules as GameModel.update_snake and check_collision, with commands
+applied the way steering.Controller applies them.
+
+`python batch.py` checks the batch against K scalar GameModels tick by tick, then measures its throughput.
+"""
+import sys
+import time
+import random
+import numpy as np
+from model import GameModel, Snake, EMPTY, SNAKE, FOOD, WALL, ORIENTATIONS, TURNS, STEPS, DEPTH_AXES
+
+DIRECTIONS = ['up', 'left', 'down', 'right']	# Codes of the directions in command arrays; -1 is no direction
+NONE = -1
+
+# The orientation tables of model.py as arrays indexed by orientation and direction codes
+UP = np.array([up for up, right in ORIENTATIONS])
+RIGHT = np.array([right for up, right in ORIENTATIONS])
+TURN_TABLE = np.array([TURNS[direction] for direction in DIRECTIONS])
+STEP_TABLE = np.array([[steps[direction] for direction in DIRECTIONS + [None]] for steps in STEPS])	# NONE indexes the last column
+DEPTH_AXIS_TABLE = np.array(DEPTH_AXES)
+
+
+class BatchGames(object):
+	"""
+	Stores K games as stacked arrays:
+		cells: (K, n, n, n) uint8 cell kinds of every game.
+		orientation: (K,) plane orientations, as indices into model.ORIENTATIONS; depth: (K,) plane depth.
+		body: (K, capacity, 3) ring buffers of snake positions, with the head of game k at body[k, start[k]]
+			and length[k] parts; the capacity doubles for all games when one of them fills its buffer.
+		direction, growth_counter, dead, score, score2: (K,) snake and score state.
+	"""
+	def __init__(self, models, capacity=64, seed=None):
+		count = len(models)
+		self.dimensions = models[0].grid.dimensions
+		self.growth_rate = models[0].snake.growth_rate
+		self.rng = np.random.RandomState(seed)
+		self.cells = np.zeros((count,) + models[0].grid.cells.shape, dtype=np.uint8)
+		self.orientation = np.zeros(count, dtype=np.int64)
+		self.depth = np.zeros(count, dtype=np.int64)
+		self.body = np.zeros((count, capacity, 3), dtype=np.int64)
+		self.start = np.zeros(count, dtype=np.int64)
+		self.length = np.zeros(count, dtype=np.int64)
+		self.direction = np.zeros(count, dtype=np.int64)
+		self.growth_counter = np.zeros(count, dtype=np.int64)
+		self.dead = np.zeros(count, dtype=bool)
+		self.score = np.zeros(count, dtype=np.int64)
+		self.score2 = np.zeros(count, dtype=np.int64)
+		self.games = np.arange(count)
+		for game, model in enumerate(models):
+			self.load(game, model)
+
+	@classmethod
+	def new(cls, count, dimensions, seed=None):
+		"""Start count new games on grids of a given width"""
+		random.seed(seed)
+		return cls([GameModel(dimensions) for game in range(count)], seed=seed)
+
+	def load(self, game, model):
+		"""Copy the state of a GameModel into one of the games, e.g. to start it again"""
+		snake = model.snake
+		while len(snake) > self.body.shape[1]:
+			self.grow_buffers()
+		self.cells[game] = model.grid.cells
+		self.orientation[game], self.depth[game] = model.plane.orientation, model.plane.depth
+		self.body[game, :len(snake)] = snake.positions()
+		self.start[game] = 0
+		self.length[game] = len(snake)
+		self.direction[game] = NONE if snake.direction is None else DIRECTIONS.index(snake.direction)
+		self.growth_counter[game] = snake.growth_counter
+		self.dead[game] = snake.dead
+		self.score[game], self.score2[game] = model.score, model.score2
+
+	@property
+	def up(self):
+		return UP[self.orientation]
+
+	@property
+	def right(self):
+		return RIGHT[self.orientation]
+
+	def heads(self):
+		return self.body[self.games, self.start]
+
+	def positions(self, game):
+		"""Return the positions of the parts of a game's snake, from head to tail"""
+		return self.body[game, (self.start[game] + np.arange(self.length[game])) % self.body.shape[1]]
+
+	def grow_buffers(self):
+		"""Double the capacity of the snake ring buffers, moving every head to the start of its buffer"""
+		capacity = self.body.shape[1]
+		ordered = self.body[self.games[:, None], (self.start[:, None] + np.arange(capacity)) % capacity]
+		self.body = np.concatenate((ordered, np.zeros_like(ordered)), axis=1)
+		self.start[:] = 0
+
+	def change_direction(self, directions):
+		"""
+		Apply an array of direction codes (NONE for no command) to the snakes that are alive,
+		with the rules of Snake.change_direction and the scoring of steering.Controller.change_direction
+		"""
+		old = self.direction
+		command = (directions != NONE) & ~self.dead
+		opposite = np.where(old == NONE, NONE, (old + 2) % 4)
+		legal = command & ((directions != opposite) | (self.length == 1))
+		self.direction = np.where(legal, directions, old)
+		self.score2 -= (old != NONE) & (old != self.direction)
+
+	def change_orientation(self, rotations):
+		"""Apply an array of rotation codes (NONE for no command) to the planes of the snakes that are alive"""
+		command = (rotations != NONE) & ~self.dead
+		self.turn(command, rotations)
+		self.score2 -= command & (self.direction != NONE)
+
+	def turn(self, games, rotations):
+		"""Rotate the planes of the selected games like Plane.turn, then reset their depth like GameModel.change_orientation"""
+		self.orientation = np.where(games, TURN_TABLE[rotations, self.orientation], self.orientation)
+		depth_axis = DEPTH_AXIS_TABLE[self.orientation]
+		self.depth = np.where(games, self.heads()[self.games, depth_axis], self.depth)
+
+	def step(self, directions=None, rotations=None):
+		"""
+		Apply commands then advance every game by one tick.
+		Return an array with the kind of block each snake's head ran into (EMPTY if none).
+		"""
+		if directions is not None:
+			self.change_direction(directions)
+		if rotations is not None:
+			self.change_orientation(rotations)
+
+		# Next head positions, like GameModel.update_snake
+		direction = self.direction
+		heads = self.heads() + STEP_TABLE[self.orientation, direction]
+
+		# Snakes leaving the cube rotate the plane instead of moving, like GameModel.move_snake
+		alive = ~self.dead
+		outside = alive & ((heads < 0) | (heads >= self.dimensions)).any(axis=1)
+		self.turn(outside, direction)
+		movers = self.games[alive & ~outside]
+		if len(movers) and (self.length[movers] == self.body.shape[1]).any():
+			self.grow_buffers()
+
+		# Push the new heads, then drop the tails of the snakes that aren't growing
+		new_heads = heads[movers]
+		capacity = self.body.shape[1]
+		grow = self.growth_counter[movers] > 0
+		self.growth_counter[movers] -= grow
+		self.start[movers] = (self.start[movers] - 1) % capacity
+		self.body[movers, self.start[movers]] = new_heads
+		shrinking = movers[~grow]
+		tails = self.body[shrinking, (self.start[shrinking] + self.length[shrinking]) % capacity]
+		self.length[movers[grow]] += 1
+		x, y, z = tails.T
+		self.cells[shrinking, x, y, z] = EMPTY
+
+		# Look at what the heads ran into before overwriting it
+		x, y, z = new_heads.T
+		contacts = np.full(len(self.games), EMPTY, dtype=np.uint8)
+		contacts[movers] = self.cells[movers, x, y, z]
+		self.cells[movers, x, y, z] = SNAKE
+
+		# Act on collisions, like GameModel.check_collision
+		self.dead |= (contacts == WALL) | (contacts == SNAKE)
+		eaten = contacts == FOOD
+		self.growth_counter += eaten * self.growth_rate
+		self.score += eaten * 10
+		self.score2 += eaten * 10
+		if eaten.any():
+			self.spawn_food(self.games[eaten])
+		return contacts
+
+	def spawn_food(self, games):
+		"""Place one food in a random empty cell of each of the given games, by sampling cells until they land on empty ones"""
+		games = games[(self.cells[games] == EMPTY).any(axis=(1, 2, 3))]
+		while len(games):
+			x, y, z = self.rng.randint(0, self.dimensions, size=(3, len(games)))
+			empty = self.cells[games, x, y, z] == EMPTY
+			self.cells[games[empty], x[empty], y[empty], z[empty]] = FOOD
+			games = games[~empty]
+
+
+class MirroredBatchGames(BatchGames):
+	"""BatchGames that places food where a list of scalar models did, so that both can be compared"""
+	def __init__(self, models, capacity=64):
+		super(MirroredBatchGames, self).__init__(models, capacity)
+		self.models = models
+
+	def spawn_food(self, games):
+		for game in games:
+			for position in self.models[game].foods:
+				self.cells[(game,) + position] = FOOD
+
+
+def differential_check(count=50, dimensions=15, ticks=500, foods=50, seed=0, capacity=4):
+	"""
+	Play the same random commands on count scalar GameModels and on a batch copied from them,
+	and check that both have the same state after every tick. Extra foods make the snakes eat and grow often,
+	and the snakes of both start with ring buffers of a small capacity, so that they wrap around and double.
+	Return the total score of the games and the capacity the batch's buffers grew to.
+	"""
+	from headless import RandomController
+	random.seed(seed)
+	models = [GameModel(dimensions) for game in range(count)]
+	for model in models:
+		model.make_food(foods)
+		snake = model.snake
+		model.snake = Snake(snake.head_position, snake.direction, snake.growth_rate, capacity)
+	controllers = [RandomController(model, random.Random(seed + game), 0.3, 0.05) for game, model in enumerate(models)]
+	batch = MirroredBatchGames(models, capacity)
+	for tick in range(ticks):
+		directions = np.full(count, NONE)
+		rotations = np.full(count, NONE)
+		for game, (model, controller) in enumerate(zip(models, controllers)):
+			if model.snake.dead:
+				continue
+			# Record the commands the controller gives to apply them to the batch too
+			old_direction, old_orientation = model.snake.direction, model.plane.orientation
+			controller.act(tick)
+			if model.snake.direction != old_direction:
+				directions[game] = DIRECTIONS.index(model.snake.direction)
+			if model.plane.orientation != old_orientation:
+				rotations[game] = list(TURN_TABLE[:, old_orientation]).index(model.plane.orientation)
+			model.update_snake()
+			model.check_collision()
+		batch.step(directions, rotations)
+		for game, model in enumerate(models):
+			assert np.array_equal(batch.cells[game], model.grid.cells), (game, tick)
+			assert np.array_equal(batch.positions(game), model.snake.positions()), (game, tick)
+			assert batch.dead[game] == model.snake.dead and batch.growth_counter[game] == model.snake.growth_counter, (game, tick)
+			assert (batch.score[game], batch.score2[game]) == (model.score, model.score2), (game, tick)
+			assert batch.orientation[game] == model.plane.orientation, (game, tick)
+			assert batch.depth[game] == model.plane.depth, (game, tick)
+	return int(batch.score.sum()), batch.body.shape[1]
+
+
+if __name__ == '__main__':
+	print('differential check: all states matched, total score %d, snake buffers grown to %d' % differential_check())
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+	dimensions = int(sys.argv[2]) if len(sys.argv) > 2 else 21
+	ticks = 200
+	batch = BatchGames.new(count, dimensions, seed=0)
+	rng = np.random.RandomState(0)
+	live_ticks = 0
+	start = time.time()
+	for tick in range(ticks):
+		live_ticks += np.count_nonzero(~batch.dead)
+		turns = np.where(rng.random_sample(count) < 0.2, rng.randint(0, 4, count), NONE)
+		batch.step(turns)
+	elapsed = time.time() - start
+	print('%d games on %d wide grids: %.0f ticks/s of live snakes' % (count, dimensions, live_ticks / elapsed))
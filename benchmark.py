@@ -0,0 +1,413 @@
+"""
+Benchmarks for the hot paths of the game.
+
+Run all of them with `python benchmark.py`, or only some with `python benchmark.py collision ...`.
+
+`python benchmark.py suite [results.json]` times grid construction, slicing, moving the snake, wall generation
+and drawing in seeded worlds of every width of SUITE_WIDTHS with snakes of every length of SUITE_LENGTHS,
+and saves the times to a file. `python benchmark.py compare old.json new.json [threshold]` then lists the
+cases that got slower by more than the threshold (0.2 for 20% by default) and exits with status 1 if any did.
+"""
+import os
+import sys
+import time
+import json
+import random
+import platform
+import numpy as np
+from model import GameModel, GameGrid, Snake, EMPTY, SNAKE, WALL
+
+SUITE_WIDTHS = (16, 51, 128, 256)
+SUITE_LENGTHS = (1, 100, 10000)
+
+
+def per_call(function, calls, repeat=3):
+    """Return the best time in seconds per call of function over a few runs"""
+    best = float('inf')
+    for run in range(repeat):
+        start = time.time()
+        for call in range(calls):
+            function()
+        best = min(best, (time.time() - start) / calls)
+    return best
+
+
+def autorange(function, repeat=3, min_time=0.1):
+    """Return the best time in seconds per call of function, with enough calls per run to last min_time"""
+    calls = 1
+    while True:
+        start = time.time()
+        for call in range(calls):
+            function()
+        if time.time() - start >= min_time:
+            break
+        calls *= 2
+    return per_call(function, calls, repeat)
+
+
+def add_random_walls(model, count, seed=0):
+    """Fill count random cells of the model with walls, away from the plane the snake starts in"""
+    rng = np.random.RandomState(seed)
+    size = model.grid.dimensions
+    placed = 0
+    while placed < count:
+        x, y, z = rng.randint(size), rng.randint(size), rng.randint(1, size)
+        if model.grid.kind_at((x, y, z)) == EMPTY:
+            model.grid.set_kind((x, y, z), WALL)
+            placed += 1
+
+
+def bench_collision(dimensions=51, wall_counts=(0, 1000, 10000, 50000), ticks=2000):
+    """Time update_snake + check_collision per tick for increasing numbers of walls"""
+    print('collision: tick cost at grid width %d' % dimensions)
+    for count in wall_counts:
+        random.seed(0)
+        model = GameModel(dimensions)
+        add_random_walls(model, count)
+        # Walk the snake around a small square so that it stays alive
+        loop = ['right', 'down', 'left', 'up']
+        state = {'tick': 0}
+
+        def tick():
+            model.snake.direction = loop[state['tick'] % 4]
+            state['tick'] += 1
+            model.update_snake()
+            model.check_collision()
+        seconds = per_call(tick, ticks)
+        assert not model.snake.dead
+        walls = np.count_nonzero(model.grid.cells == WALL)
+        print('  %6d walls: %8.2f us/tick' % (walls, seconds * 1e6))
+
+
+def bench_food(dimensions=51, fill_ratios=(0, 0.5, 0.9, 0.999), foods=1000):
+    """Time make_food per food for increasingly full worlds"""
+    print('food: placement cost at grid width %d' % dimensions)
+    for ratio in fill_ratios:
+        random.seed(0)
+        model = GameModel(dimensions)
+        grid = model.grid
+        full = np.random.RandomState(0).random_sample(grid.cells.shape) < ratio
+        grid.cells[full & (grid.cells == EMPTY)] = WALL
+        grid.rebuild_free_index()
+        placed = len(model.foods)
+        start = time.time()
+        model.make_food(foods)
+        seconds = (time.time() - start) / max(len(model.foods) - placed, 1)
+        print('  %5.1f%% full: %8.2f us/food' % (ratio * 100, seconds * 1e6))
+
+
+def bench_terrain(widths=(51, 128, 256), blobs=((6, 9), (200, 9)), walks=(1000, 200), repeat=3):
+    """Time blob and random walk wall generation for a few grid widths, in a fresh world every time"""
+    print('terrain: generation time')
+    num_walks, walk_length = walks
+    generators = [('%3d blobs of size %d' % (num_blobs, size_blobs),
+                   lambda model, num_blobs=num_blobs, size_blobs=size_blobs: model.make_blob_walls(num_blobs, size_blobs, seed=0))
+                  for num_blobs, size_blobs in blobs]
+    generators.append(('%d walks of %d steps' % walks,
+                       lambda model: model.make_random_walls(num_walks, walk_length, seed=0)))
+    for dimensions in widths:
+        for name, generate in generators:
+            best = float('inf')
+            for run in range(repeat):
+                random.seed(0)
+                model = GameModel(dimensions)
+                start = time.time()
+                generate(model)
+                best = min(best, time.time() - start)
+            print('  width %3d, %s: %8.2f ms' % (dimensions, name, best * 1e3))
+
+
+def bench_render(widths=(51, 128), square_size=4, frames=50):
+    """Time GameView.draw per frame while the snake moves, for each way of drawing the slice"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from view import GameView, ArrayGameView
+    pygame.init()
+    renderers = [
+        ('rects, full redraw', lambda model, screen: GameView(model, screen, square_size, incremental=False)),
+        ('rects, incremental', lambda model, screen: GameView(model, screen, square_size)),
+        ('array blit', lambda model, screen: ArrayGameView(model, screen, square_size)),
+    ]
+    print('render: draw time per frame')
+    for dimensions in widths:
+        pixels = dimensions * square_size
+        screen = pygame.display.set_mode((pixels, int(pixels * 1.08)))
+        for name, make_view in renderers:
+            random.seed(0)
+            model = GameModel(dimensions)
+            model.snake.direction = 'right'
+            view = make_view(model, screen)
+            view.draw()
+
+            def frame():
+                model.update_snake()
+                model.check_collision()
+                view.draw()
+            seconds = per_call(frame, frames, repeat=1)
+            print('  width %3d, %-20s %8.2f ms' % (dimensions, name + ':', seconds * 1e3))
+    pygame.quit()
+
+
+def bench_pipeline(widths=(51, 256), ticks_per_second=30, ticks=150, length=100):
+    """
+    Play a snake along a path at a fixed tick rate and time the work of the game loop's thread per tick,
+    drawing with ArrayGameView or with PipelinedGameView, whose frame counts are printed too
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from view import ArrayGameView, PipelinedGameView
+    pygame.init()
+    print('pipeline: main thread time per tick at %d ticks/s' % ticks_per_second)
+    for dimensions in widths:
+        square_size = max(1, 512 // dimensions)
+        pixels = dimensions * square_size
+        screen = pygame.display.set_mode((pixels, int(pixels * 1.08)))
+        for name, view_class in (('array', ArrayGameView), ('pipelined', PipelinedGameView)):
+            model, path = make_world(dimensions, length)
+            view = view_class(model, screen, square_size)
+            move = follower(model, path)
+            busy = 0.0
+            next_tick = time.time()
+            for tick in range(ticks):
+                start = time.time()
+                move()
+                view.draw()
+                busy += time.time() - start
+                next_tick += 1.0 / ticks_per_second
+                time.sleep(max(0.0, next_tick - time.time()))
+            line = '  width %3d, %-10s %8.3f ms/tick' % (dimensions, name + ':', busy / ticks * 1e3)
+            if name == 'pipelined':
+                view.close()
+                line += ('; frames: %(submitted)d submitted, %(dropped)d dropped, %(skipped)d skipped, %(shown)d shown, '
+                         '%(worker_ms).2f ms of work, %(latency_ms).1f ms latency' % view.pipeline.metrics())
+            print(line)
+    pygame.quit()
+
+
+def wall_in_food(model):
+    """Surround every food of a model with walls, so that no snake can reach it"""
+    for x, y, z in list(model.foods):
+        for dx, dy, dz in ((1, 0, 0), (-1, 0, 0), (0, 1, 0), (0, -1, 0), (0, 0, 1), (0, 0, -1)):
+            position = (x + dx, y + dy, z + dz)
+            if all(0 <= c < model.grid.dimensions for c in position) and model.grid.kind_at(position) == EMPTY:
+                model.grid.set_kind(position, WALL)
+
+
+def bench_autopilot(widths=(51, 256), ticks=2000):
+    """
+    Time the planning of AIController.act per tick while it plays, starting a new game whenever the snake dies,
+    with food it can reach and with every food walled in, where it should search once and then only escape
+    """
+    from autopilot import AIController
+    print('autopilot: planning time per tick, %d ticks' % ticks)
+    for walled in (False, True):
+        for dimensions in widths:
+            times, plans, score, games = [], 0, 0, 0
+            while len(times) < ticks:
+                model = GameModel(dimensions, seed=games)
+                if walled:
+                    wall_in_food(model)
+                controller = AIController(model)
+                games += 1
+                while len(times) < ticks and not model.snake.dead:
+                    start = time.time()
+                    controller.act()
+                    times.append(time.time() - start)
+                    model.update_snake()
+                    model.check_collision()
+                plans += controller.planner.plans
+                score += model.score
+            times.sort()
+            print('  width %3d%s: %7.1f us/tick mean, %7.1f us median, %8.1f us max; %d plans in %d games, score %d' % (
+                dimensions, ', food walled in' if walled else '', sum(times) / len(times) * 1e6,
+                times[len(times) // 2] * 1e6, times[-1] * 1e6, plans, games, score))
+
+
+class DictWall(object):
+    """Wall block with a __dict__ rather than slots, as blocks were, to compare their memory with"""
+    def __init__(self, x, y, z):
+        self.x, self.y, self.z = (x, y, z)
+
+
+def held_bytes(build):
+    """
+    Return what build() returns and the number of bytes it holds, measured with tracemalloc where it exists
+    (Python 3) and estimated with sys.getsizeof of the list, its items and their __dict__ otherwise
+    """
+    try:
+        import tracemalloc
+    except ImportError:
+        result = build()
+        return result, sys.getsizeof(result) + sum(sys.getsizeof(item) + sys.getsizeof(getattr(item, '__dict__', None))
+                                                   for item in result)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return result, held
+
+
+def bench_memory(dimensions=128, blobs=200):
+    """Print the bytes per wall held by the list of Wall blocks of a world and by the grid, and the shared background objects"""
+    from model import Wall, Food, SnakeBodyPart, BackgroundObject, WALL
+    random.seed(0)
+    model = GameModel(dimensions)
+    model.make_blob_walls(blobs, 9, seed=0)
+    positions = model.grid.positions_of(WALL).tolist()
+    print('memory: %d walls in a %d wide world' % (len(positions), dimensions))
+    walls, held = held_bytes(lambda: model.walls)
+    print('  Wall blocks with slots:     %6.1f bytes/wall' % (held / float(len(walls))))
+    del walls
+    walls, held = held_bytes(lambda: [DictWall(*position) for position in positions])
+    print('  Wall blocks with __dict__:  %6.1f bytes/wall' % (held / float(len(walls))))
+    del walls
+    print('  grid cells:                 %6.1f bytes/wall' % (model.grid.cells.nbytes / float(len(positions))))
+    backgrounds = set(id(BackgroundObject(block_type(0, 0, 0))) for block_type in (SnakeBodyPart, Food, Wall) for copy in range(3))
+    print('  background objects:         %6d in all' % len(backgrounds))
+
+
+def serpentine(dimensions, count):
+    """
+    Return the first count cells of a path through the whole cube, as a list of positions.
+    The path goes back and forth along x, then y, then z, so that consecutive cells are neighbours.
+    """
+    k = np.arange(count)
+    z, rest = np.divmod(k, dimensions * dimensions)
+    row, x = np.divmod(rest, dimensions)
+    x = np.where((z * dimensions + row) % 2, dimensions - 1 - x, x)
+    y = np.where(z % 2, dimensions - 1 - row, row)
+    return [tuple(position) for position in np.stack((x, y, z), axis=1).tolist()]
+
+
+def make_world(dimensions, length=1, seed=0, spare=50000):
+    """
+    Return a model with a snake of a given length laid along a serpentine path, seeded blob walls and one food,
+    and the path, which goes on for spare cells (or around the whole cube) ahead of the head.
+    """
+    random.seed(seed)
+    model = GameModel(dimensions)
+    model.grid = GameGrid(dimensions)
+    model.foods = {}
+    path = serpentine(dimensions, min(dimensions ** 3, length + spare))
+    model.snake = Snake(path[0])
+    model.grid.set_kind(path[0], SNAKE)
+    for position in path[1:length]:
+        model.snake.move(*position, eaten=True)
+        model.grid.set_kind(position, SNAKE)
+    model.make_blob_walls(6, 9, seed=seed)
+    model.make_food()
+    return model, path
+
+
+def suite_cases(widths=SUITE_WIDTHS, lengths=SUITE_LENGTHS):
+    """Yield (name, function to time) for every case of the suite, setting up each world when it is reached"""
+    for dimensions in widths:
+        yield 'grid/%d' % dimensions, lambda: GameGrid(dimensions)
+
+        model = make_world(dimensions, spare=0)[0]
+
+        def blobs(model=model):
+            # Includes building an empty grid, timed on its own by grid/<width>
+            model.grid = GameGrid(dimensions)
+            model.make_blob_walls(6, 9, seed=0)
+        yield 'blobs/%d' % dimensions, blobs
+
+        for length in lengths:
+            if length >= dimensions ** 3:
+                continue
+            # The snake follows the path in a loop, and keeps its length as it never grows
+            model, path = make_world(dimensions, length)
+            yield 'move/%d/%d' % (dimensions, length), follower(model, path)
+
+        model, path = make_world(dimensions, 100)
+        views = suite_views(model)
+        yield 'slice/%d' % dimensions, views[0][1].get_slice
+        move = follower(model, path)
+        for name, view in views:
+            view.draw()
+
+            def frame(view=view):
+                move()
+                view.draw()
+            yield 'draw-%s/%d' % (name, dimensions), frame
+
+
+def follower(model, path):
+    """Return a function moving the snake of a model to the next cell of a path on every call"""
+    state = {'tick': len(model.snake)}
+
+    def follow():
+        model.move_snake(*path[state['tick'] % len(path)])
+        state['tick'] += 1
+    return follow
+
+
+def suite_views(model):
+    """Return (name, view) for each renderer, on a dummy display at most 512 pixels wide"""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from view import GameView, ArrayGameView
+    pygame.init()
+    square_size = max(1, 512 // model.grid.dimensions)
+    pixels = model.grid.dimensions * square_size
+    screen = pygame.display.set_mode((pixels, int(pixels * 1.08)))
+    return [('rects', GameView(model, screen, square_size)), ('array', ArrayGameView(model, screen, square_size))]
+
+
+def run_suite(path=None):
+    """Time every case of the suite, print the times and save them to a file if given one"""
+    results = {}
+    print('suite: best time per call')
+    for name, function in suite_cases():
+        results[name] = autorange(function)
+        print('  %-20s %10.3f ms' % (name, results[name] * 1e3))
+    if path:
+        import pygame
+        info = {'python': platform.python_version(), 'numpy': np.__version__, 'pygame': pygame.version.ver,
+                'machine': platform.platform(), 'time': time.strftime('%Y-%m-%d %H:%M:%S')}
+        with open(path, 'w') as output:
+            json.dump({'info': info, 'results': results}, output, indent=2, sort_keys=True)
+        print('saved to %s' % path)
+    return results
+
+
+def compare(old_path, new_path, threshold=0.2):
+    """Print the times of two saved runs side by side and return the names of the cases more than threshold slower"""
+    with open(old_path) as old_file, open(new_path) as new_file:
+        old, new = json.load(old_file)['results'], json.load(new_file)['results']
+    regressions = []
+    print('%-20s %10s %10s %8s' % ('case', 'old ms', 'new ms', 'ratio'))
+    for name in sorted(set(old) & set(new)):
+        ratio = new[name] / old[name]
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print('%-20s %10.3f %10.3f %7.2fx%s' % (name, old[name] * 1e3, new[name] * 1e3, ratio, flag))
+    for name in sorted(set(old) ^ set(new)):
+        print('%-20s only in %s' % (name, old_path if name in old else new_path))
+    return regressions
+
+
+BENCHMARKS = {
+    'autopilot': bench_autopilot,
+    'collision': bench_collision,
+    'food': bench_food,
+    'memory': bench_memory,
+    'pipeline': bench_pipeline,
+    'render': bench_render,
+    'terrain': bench_terrain,
+}
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['suite']:
+        run_suite(*sys.argv[2:3])
+    elif sys.argv[1:2] == ['compare']:
+        threshold = float(sys.argv[4]) if len(sys.argv) > 4 else 0.2
+        sys.exit(1 if compare(sys.argv[2], sys.argv[3], threshold) else 0)
+    else:
+        names = sys.argv[1:] or sorted(BENCHMARKS)
+        for name in names:
+            BENCHMARKS[name]()
@@ -0,0 +1,141 @@
+"""
+Sparse storage of the cells of very wide worlds, in cubic chunks allocated on first write.
+
+A ChunkedCells indexes like the dense uint8 cube of a GameGrid, with three integers or three broadcastable
+integer arrays, so the terrain generators and the grid methods work on it unchanged, but only the chunks
+that ever held a non-empty (non-zero) cell take memory. Every chunk keeps a summary of where its occupied
+cells are along each axis, which the projection engine uses to find background blocks without reading
+the cells of chunks away from the plane.
+"""
+import numpy as np
+
+CHUNK = 16
+
+
+class ChunkedCells(object):
+	"""
+	Sparse cube of cell kinds.
+
+	Data:
+		chunks: dict mapping the flat index of a chunk (see chunk_key) to its uint8 array of shape (size, size, size).
+		summaries: dict mapping the flat index of a chunk to its (tops, kinds) summary, see summary.
+	"""
+	def __init__(self, dimensions, size=CHUNK):
+		self.shape = (dimensions,) * 3
+		self.size = size
+		self.shift = size.bit_length() - 1
+		self.mask = size - 1
+		self.count = -(-dimensions // size)		# Chunks along each axis
+		self.chunks = {}
+		self.summaries = {}
+		assert size == 1 << self.shift, 'the chunk size must be a power of two'
+
+	def chunk_key(self, x, y, z):
+		"""Return the flat index of the chunk holding a cell, for integers or arrays"""
+		return ((x >> self.shift) * self.count + (y >> self.shift)) * self.count + (z >> self.shift)
+
+	def chunk_origin(self, key):
+		"""Return the position of the first cell of a chunk"""
+		cx, rest = divmod(key, self.count * self.count)
+		cy, cz = divmod(rest, self.count)
+		return (cx << self.shift, cy << self.shift, cz << self.shift)
+
+	def __getitem__(self, index):
+		x, y, z = index
+		if isinstance(x, (int, np.integer)) and isinstance(y, (int, np.integer)) and isinstance(z, (int, np.integer)):
+			chunk = self.chunks.get(self.chunk_key(x, y, z))
+			return chunk[x & self.mask, y & self.mask, z & self.mask] if chunk is not None else np.uint8(0)
+		x, y, z = np.broadcast_arrays(np.asarray(x), np.asarray(y), np.asarray(z))
+		kinds = np.zeros(x.shape, dtype=np.uint8)
+		for key, cells in self.groups(x, y, z):
+			chunk = self.chunks.get(key)
+			if chunk is not None:
+				kinds.flat[cells] = chunk[x.flat[cells] & self.mask, y.flat[cells] & self.mask, z.flat[cells] & self.mask]
+		return kinds
+
+	def __setitem__(self, index, kinds):
+		x, y, z = index
+		if isinstance(x, (int, np.integer)) and isinstance(y, (int, np.integer)) and isinstance(z, (int, np.integer)):
+			chunk = self.chunk(self.chunk_key(x, y, z), kinds)
+			if chunk is not None:
+				chunk[x & self.mask, y & self.mask, z & self.mask] = kinds
+			return
+		x, y, z = np.broadcast_arrays(np.asarray(x), np.asarray(y), np.asarray(z))
+		kinds = np.broadcast_to(np.asarray(kinds, dtype=np.uint8), x.shape)
+		for key, cells in self.groups(x, y, z):
+			chunk = self.chunk(key, kinds.flat[cells].max())
+			if chunk is not None:
+				chunk[x.flat[cells] & self.mask, y.flat[cells] & self.mask, z.flat[cells] & self.mask] = kinds.flat[cells]
+
+	def chunk(self, key, kind):
+		"""Return the chunk to write a kind to, allocating it unless it is missing and the kind is empty, and mark it changed"""
+		chunk = self.chunks.get(key)
+		if chunk is None and kind:
+			chunk = self.chunks[key] = np.zeros((self.size,) * 3, dtype=np.uint8)
+		self.summaries.pop(key, None)
+		return chunk
+
+	def groups(self, x, y, z):
+		"""Yield (chunk key, flat indices of the cells in it) for the cells of broadcast index arrays"""
+		keys = self.chunk_key(x, y, z).ravel()
+		order = np.argsort(keys, kind='mergesort')
+		sorted_keys = keys[order]
+		starts = np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1]))) if len(keys) else []
+		ends = list(starts[1:]) + [len(keys)]
+		for start, end in zip(starts, ends):
+			yield int(sorted_keys[start]), order[start:end]
+
+	def summary(self, key):
+		"""
+		Return (tops, kinds) for a chunk: for each axis, the highest index along that axis of an occupied cell
+		of every line of the chunk (-1 if it has none) and the kind of that cell, as arrays over the other two axes
+		"""
+		if key not in self.summaries:
+			chunk = self.chunks[key]
+			tops, kinds = [], []
+			for axis in range(3):
+				top, kind = line_tops(chunk, axis)
+				tops.append(top)
+				kinds.append(kind)
+			self.summaries[key] = (tops, kinds)
+		return self.summaries[key]
+
+	def nonzero(self):
+		"""Return the positions of the non-empty cells in the same order as numpy.argwhere, as an array of shape (count, 3)"""
+		positions = [np.argwhere(chunk) + self.chunk_origin(key) for key, chunk in self.chunks.items()]
+		if not positions:
+			return np.zeros((0, 3), dtype=np.int64)
+		positions = np.concatenate(positions)
+		return positions[np.lexsort(positions.T[::-1])]
+
+	def kinds_at(self, positions):
+		"""Return the kinds of the cells at an array of positions of shape (count, 3)"""
+		return self[tuple(np.transpose(positions))]
+
+	def copy(self):
+		"""Return an independent copy of the cells"""
+		cells = ChunkedCells(self.shape[0], self.size)
+		cells.chunks = dict((key, chunk.copy()) for key, chunk in self.chunks.items())
+		return cells
+
+	def nbytes(self):
+		return sum(chunk.nbytes for chunk in self.chunks.values())
+
+	def tobytes(self):
+		"""Return the keys and contents of the chunks that hold something, e.g. to hash the cells"""
+		return b''.join(np.int64(key).tobytes() + chunk.tobytes() for key, chunk in sorted(self.chunks.items()) if chunk.any())
+
+
+def line_tops(cells, axis, exclude=None):
+	"""
+	Return, for every line of a block of cells along an axis, the highest index of an occupied cell (-1 if none)
+	and its kind, as arrays over the other two axes; the cells at index exclude along the axis are ignored
+	"""
+	occupied = cells != 0
+	if exclude is not None:
+		occupied[(slice(None),) * axis + (exclude,)] = False
+	size = cells.shape[axis]
+	top = size - 1 - np.argmax(np.flip(occupied, axis), axis=axis)
+	top[~occupied.any(axis=axis)] = -1
+	kind = np.take_along_axis(cells, np.expand_dims(np.maximum(top, 0), axis), axis=axis).squeeze(axis)
+	return top, kind
@@ -1,17 +1,41 @@
 import pygame
-import numpy as np
+from steering import Controller, DIRECTIONS
 
-class GameController(object):
+# Default key bindings: key -> (command, direction), where the command is 'direction' to steer the snake
+# and 'orientation' to rotate the plane, like the commands of headless.ScriptedController
+DEFAULT_BINDINGS = dict(
+    [(key, ('direction', direction)) for key, direction in zip([pygame.K_UP, pygame.K_LEFT, pygame.K_DOWN, pygame.K_RIGHT], DIRECTIONS)] +
+    [(key, ('orientation', direction)) for key, direction in zip([pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d], DIRECTIONS)])
+
+
+class GameController(Controller):
     """
     Manipulates the model according to user input.
 
     Actions:
         * Change direction of the snake
         * Change orientation of the axes
-        * Quit or restart game after death
+        * Quit, restart in a new world or on the same map, or undo the last seconds of the game after death
+
+    Key presses are not acted on right away: their commands are queued, see steering.Controller, which also
+    holds the scoring rules and undo. This class only maps pygame events to them.
     """
-    def __init__(self, model):
-        self.model = model
+    def __init__(self, model, bindings=None, queue_length=4, checkpoint_interval=12, checkpoint_count=3):
+        super(GameController, self).__init__(model, queue_length, checkpoint_interval, checkpoint_count)
+        self.bindings = dict(DEFAULT_BINDINGS) #Key -> (command, direction); bindings given here add to or replace the defaults
+        self.bindings.update(bindings or {})
+        self.changed = False #Whether the last batch of events queued a command or changed the model
+
+    def handle_events(self, events):
+        """
+        Respond to a batch of events, return boolean for whether to continue running the program.
+        Sets changed if any of them queued a command or changed the model, so that other events don't cause redraws.
+        """
+        self.changed = False
+        running = True
+        for event in events:
+            running = self.handle_event(event) and running
+        return running
 
     def handle_event(self, event):
         """Respond to key presses, return boolean for whether to continue running the program"""
@@ -25,29 +49,15 @@ class GameController(object):
             if event.key == pygame.K_q:
                 # Quit
                 return False
-            elif event.key == pygame.K_r:
-                # Restart the game.
-                self.model.restart()
-                return True
-
-        old_direction = self.model.snake.direction
-
-        directions = ['up', 'left', 'down', 'right']
-
-        direction_keys = [pygame.K_UP, pygame.K_LEFT, pygame.K_DOWN, pygame.K_RIGHT]
-        control_dict = {key: value for key, value in zip(direction_keys, directions)}
-
-        orientation_keys = [pygame.K_w, pygame.K_a, pygame.K_s, pygame.K_d]
-        orient_dict = {key: value for key, value in zip(orientation_keys, directions)}
-
-        if event.key in direction_keys: #Change direction of the snake, decrease score by 1
-            self.model.snake.change_direction(control_dict[event.key])
-            if old_direction is not None and old_direction != self.model.snake.direction:
-                self.model.score2 -= 1
+            elif event.key in (pygame.K_r, pygame.K_m):
+                # Restart the game, on the same map for M
+                self.restart(same_map=event.key == pygame.K_m)
+                self.changed = True
+            elif event.key == pygame.K_u:
+                self.undo()
+                self.changed = True
+            return True
 
-        if event.key in orientation_keys: #Change orientation of the model, decrease score by 1
-            self.model.change_orientation(orient_dict[event.key])
-            if old_direction is not None:
-                self.model.score2 -= 1
+        if event.key in self.bindings and self.queue_command(*self.bindings[event.key]):
+            self.changed = True
         return True
-
@@ -1,37 +1,184 @@
+"""
+Play the game: python game.py. The settings below are the options.
+
+`python game.py --measure-startup [grid width] [--chunked]` opens the window, builds the world, draws the first frame
+and quits, reporting how long each step took since the script started.
+"""
+import time
+started = time.time()
+import os
+import sys
+import threading
 import pygame
 from model import GameModel
-from view import GameView
+from view import GameView, ArrayGameView, PipelinedGameView
 from controller import GameController
-import time
 
 square_width = 10 # pixels
 grid_width = 51
+chunked = False # store the world sparsely in chunks, for grids hundreds of cells wide
 pixels_wide = square_width * grid_width
-ms_per_block = 2 # screen refreshes per move
+ticks_per_second = 12 # snake moves per second, independent of the frame rate
+max_fps = 60 # cap on screen refreshes per second
+max_ticks_per_frame = 5 # if a frame takes too long, drop the ticks beyond this instead of trying to catch up
 score_font_size = 14
+key_bindings = {} # added or replaced key bindings, e.g. {pygame.K_i: ('direction', 'up'), pygame.K_k: ('orientation', 'down')}
+renderer = 'rects' # 'rects' to draw the cells that changed with pygame.draw.rect, 'array' to blit the whole slice at once,
+                   # 'pipelined' to prepare the slices on a worker thread while the loop handles input and blits the previous frame
+record = None # path of a log to record the first game to, to replay it with replay.py
+profile = False # time the phases of every frame and show them below the field
+profile_dump = 'profile.json' # where to write the timings on exit when profiling, as .json or .csv
+seed = None # seed of the world, to play on the same map every time
+autopilot = False # let an AIController steer the snake to the food
+world_cache = None # directory of generated worlds: with a seed, the world is loaded from there if it was saved before, else saved to it
+
+
+def show_message(screen, message):
+	"""Fill the screen with black and print a message in its middle"""
+	screen.fill(pygame.Color('black'))
+	text = pygame.font.Font(None, 32).render(message, 1, (200, 200, 200))
+	screen.blit(text, text.get_rect(center=screen.get_rect().center))
+	pygame.display.update()
+
+
+def build_model():
+	"""Return a new GameModel, loaded from or saved to the world cache when there is one and the seed is set"""
+	if world_cache is None or seed is None or chunked:
+		return GameModel(grid_width, seed, chunked=chunked)
+	import savefile
+	path = os.path.join(world_cache, 'world-%d-%d.sav' % (grid_width, seed))
+	if os.path.exists(path):
+		return savefile.load(path)
+	model = GameModel(grid_width, seed)
+	if not os.path.isdir(world_cache):
+		os.makedirs(world_cache)
+	savefile.save(model, path)
+	return model
+
+
+def build_in_background():
+	"""Build the model on a thread while the window keeps handling its events. Return it, or None if the window was closed"""
+	result = {}
+
+	def build():
+		try:
+			result['model'] = build_model()
+		except Exception as error:
+			result['error'] = error
+	thread = threading.Thread(target=build)
+	thread.daemon = True
+	thread.start()
+	while thread.is_alive():
+		if any(event.type == pygame.QUIT for event in pygame.event.get()):
+			return None
+		thread.join(0.01)
+	if 'error' in result:
+		raise result['error']
+	return result['model']
+
 
 if __name__ == '__main__':
+	measure_startup = '--measure-startup' in sys.argv
+	if measure_startup:
+		arguments = [argument for argument in sys.argv[1:] if not argument.startswith('--')]
+		chunked = chunked or '--chunked' in sys.argv
+		if arguments:
+			grid_width = int(arguments[0])
+			square_width = max(1, pixels_wide // grid_width)
+			pixels_wide = square_width * grid_width
+	steps = [('imports', time.time())]
+
 	pygame.init()
 	size = (pixels_wide, int(pixels_wide*1.08) )# + score_font_size + 14)
 	screen = pygame.display.set_mode(size)
+	show_message(screen, 'Building the world...')
+	steps.append(('window', time.time()))
 
-	model = GameModel(grid_width)
-	view = GameView(model, screen, square_width)
-	controller = GameController(model)
+	model = build_in_background()
+	if model is None:
+		pygame.quit()
+		sys.exit()
+	model.keep_start() # so that M restarts on the same map without generating it again
+	steps.append(('world', time.time()))
+	views = {'array': ArrayGameView, 'rects': GameView, 'pipelined': PipelinedGameView}
+	view = views[renderer](model, screen, square_width)
+	controller = GameController(model, key_bindings)
+	pilot = None
+	if autopilot:
+		from autopilot import AIController
+		pilot = AIController(model) # steers on its own, while the keys still work
+	view.draw()
+	# draw may already show the first frame, if the worker finished it in time: wait until one has been shown
+	while renderer == 'pipelined' and view.pipeline.counts['shown'] == 0:
+		time.sleep(0.001)
+		view.present()
+	steps.append(('first frame', time.time()))
+	if measure_startup:
+		print('startup of a %d wide %s world, since game.py started:' % (grid_width, 'chunked' if chunked else 'dense'))
+		previous = started
+		for step, end in steps:
+			print('  %-12s %7.1f ms (+%.1f)' % (step, (end - started) * 1e3, (end - previous) * 1e3))
+			previous = end
+		if renderer == 'pipelined':
+			view.close()
+		pygame.quit()
+		sys.exit()
 
+	recorder = None
+	if record:
+		from replay import Recorder
+		recorder = Recorder(record, model, *[steerer for steerer in (controller, pilot) if steerer])
+	profiler = None
+	if profile:
+		from profiler import Profiler
+		profiler = Profiler()
+		profiler.instrument_game(model, view, controller)
+
+	clock = pygame.time.Clock()
+	ms_per_tick = 1000.0 / ticks_per_second
+	lag = 0.0 # ms of game time not simulated yet
+	changed = False # whether the model changed since the last frame
 	running = True
-	count = 0
 	while running:
-		view.draw()
-		for event in pygame.event.get():
-			# if event.type == pygame.QUIT:
-			# 	running = False
-			running = controller.handle_event(event)
-		count += 1
-		if count == ms_per_block:
-			model.update_snake()
-			model.check_collision()
-			count = 0
-
-		time.sleep(.001)
-	pygame.QUIT
+		lag += clock.tick(max_fps) # sleeps to cap the frame rate, returns ms elapsed since the last frame
+		if profiler:
+			profiler.start_frame()
+		events = pygame.event.get()
+		if events:
+			running = controller.handle_events(events)
+			changed = changed or controller.changed
+
+		# Advance the model by fixed steps for the time that passed
+		lag = min(lag, max_ticks_per_frame * ms_per_tick)
+		while lag >= ms_per_tick:
+			if not model.snake.dead:
+				if pilot:
+					pilot.act()
+				controller.checkpoint()
+				controller.apply_command()
+				model.update_snake()
+				model.check_collision()
+				changed = True
+				if recorder:
+					recorder.tick()
+					if model.snake.dead:
+						recorder.close()
+						recorder = None
+			lag -= ms_per_tick
+
+		if changed:
+			view.draw()
+			changed = False
+		elif renderer == 'pipelined':
+			view.present() # show the frame the worker finished since the last draw, if any
+		if profiler:
+			profiler.end_frame()
+	if recorder:
+		recorder.close()
+	if profiler:
+		profiler.dump(profile_dump)
+	if renderer == 'pipelined':
+		view.close()
+		print('frames: %(submitted)d submitted, %(dropped)d dropped, %(skipped)d skipped, %(shown)d shown; '
+			'%(worker_ms).2f ms of work and %(latency_ms).1f ms latency per frame' % view.pipeline.metrics())
+	pygame.quit()
@@ -0,0 +1,94 @@
+"""
+Run games without a display, driven by scripted or random controllers, to soak test and benchmark the simulation.
+
+`python headless.py [games] [ticks] [grid width] [processes]` plays many independent random games
+in a pool of processes and reports how many ticks per second were simulated.
+"""
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import sys
+import time
+import random
+import multiprocessing
+from model import GameModel
+from steering import Controller, DIRECTIONS
+
+
+class RandomController(Controller):
+	"""Steers the snake at random: every tick, it turns and rotates the plane with given probabilities"""
+	def __init__(self, model, rng=random, turn_probability=0.2, rotate_probability=0.02):
+		super(RandomController, self).__init__(model)
+		self.rng = rng
+		self.turn_probability = turn_probability
+		self.rotate_probability = rotate_probability
+
+	def act(self, tick):
+		if self.model.snake.direction is None or self.rng.random() < self.turn_probability:
+			self.change_direction(self.rng.choice(DIRECTIONS))
+		if self.rng.random() < self.rotate_probability:
+			self.change_orientation(self.rng.choice(DIRECTIONS))
+
+
+class ScriptedController(Controller):
+	"""Plays back a script: a dict mapping ticks to lists of ('direction' or 'orientation', direction) commands"""
+	def __init__(self, model, script):
+		super(ScriptedController, self).__init__(model)
+		self.script = script
+
+	def act(self, tick):
+		for command, direction in self.script.get(tick, []):
+			getattr(self, 'change_' + command)(direction)
+
+
+def run(model, controller, ticks):
+	"""Let the controller act then advance the model, for a number of ticks or until the snake dies. Return the number of ticks run"""
+	for tick in range(ticks):
+		if model.snake.dead:
+			return tick
+		controller.act(tick)
+		model.update_snake()
+		model.check_collision()
+	return ticks
+
+
+def play_random_games(job):
+	"""
+	Play random games with a given seed on a grid of a given width for a total number of ticks,
+	starting a new game whenever the snake dies. Return statistics about them.
+	"""
+	seed, ticks, dimensions = job
+	rng = random.Random(seed)
+	random.seed(seed)
+	stats = {'ticks': 0, 'games': 0, 'best_score': 0, 'seconds': 0.0}
+	while stats['ticks'] < ticks:
+		model = GameModel(dimensions)
+		start = time.time()
+		stats['ticks'] += run(model, RandomController(model, rng), ticks - stats['ticks'])
+		stats['seconds'] += time.time() - start
+		stats['games'] += 1
+		stats['best_score'] = max(stats['best_score'], model.score)
+	return stats
+
+
+def run_batch(games, ticks, dimensions, processes=None):
+	"""Play games independent random games of the given number of ticks each across a pool of processes and return their statistics"""
+	pool = multiprocessing.Pool(processes)
+	try:
+		return pool.map(play_random_games, [(seed, ticks, dimensions) for seed in range(games)])
+	finally:
+		pool.close()
+		pool.join()
+
+
+if __name__ == '__main__':
+	arguments = [int(argument) for argument in sys.argv[1:]]
+	games, ticks, dimensions, processes = arguments + [1000, 1000, 51, multiprocessing.cpu_count()][len(arguments):]
+	start = time.time()
+	results = run_batch(games, ticks, dimensions, processes)
+	elapsed = time.time() - start
+	total_ticks = sum(result['ticks'] for result in results)
+	simulation_seconds = sum(result['seconds'] for result in results)
+	print('%d games of %d ticks on a %d wide grid with %d processes' % (games, ticks, dimensions, processes))
+	print('  %d snakes lived, best score %d' % (sum(result['games'] for result in results), max(result['best_score'] for result in results)))
+	print('  %.0f ticks/s overall, %.0f ticks/s per process (excluding world generation), %.1f s' % (
+		total_ticks / elapsed, total_ticks / simulation_seconds, elapsed))
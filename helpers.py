@@ -1,8 +1,11 @@
 def vector_add(*args):
-	i = sum([arg[0] for arg in args])
-	j = sum([arg[1] for arg in args])
-	k = sum([arg[2] for arg in args])
+	i = j = k = 0
+	for x, y, z in args:
+		i += x
+		j += y
+		k += z
 	return (i, j, k)
 
 def vector_multiply(scalar, vector):
-	return tuple([scalar * component for component in vector])
+	x, y, z = vector
+	return (scalar * x, scalar * y, scalar * z)
@@ -1,316 +1,694 @@
-import pygame
-from linkedlist import Node, LinkedList
+import copy
 import random
+import hashlib
 import numpy as np
+from collections import namedtuple
+import terrain
+from chunks import ChunkedCells, CHUNK
+from occupancy import LineIndex
+from helpers import vector_add
+
+# Cell kinds stored in the grid and in the images produced by the projection engine
+EMPTY, SNAKE, FOOD, WALL = range(4)
+BACKGROUND = 4		# Flag added to a kind for blocks outside of the current plane
+LINE_INDEX_WIDTH = 32		# Narrower grids are projected from the whole cube, cheaper than keeping a LineIndex
+
+# The direction a snake can't turn to from each direction, unless it is only a head
+OPPOSITES = {'up': 'down', 'left': 'right', 'down': 'up', 'right': 'left', None: None}
+
+# State of a model other than its cells, saved by GameModel.snapshot; the cells are restored from the grid's journal.
+# The start of a game kept for restarts has no journal_length: its cells are restored from the grid's start_kinds
+Snapshot = namedtuple('Snapshot', ['journal_length', 'snake', 'foods', 'orientation', 'depth', 'contact', 'dead',
+	'score', 'score2', 'random_state'])
+
+# What the snake's head ran into on its last move
+Collision = namedtuple('Collision', ['kind', 'position'])
+
+
+def cross(a, b):
+	"""Cross product of two 3-tuples"""
+	return (a[1]*b[2] - a[2]*b[1], a[2]*b[0] - a[0]*b[2], a[0]*b[1] - a[1]*b[0])
+
+# The 24 orientations a Plane can be in, as (up, right) pairs of perpendicular unit vectors.
+# Everything about them is precomputed so that moving and turning are table lookups.
+UNIT_VECTORS = [(1,0,0),(0,1,0),(0,0,1),(-1,0,0),(0,-1,0),(0,0,-1)]
+ORIENTATIONS = [(up, right) for up in UNIT_VECTORS for right in UNIT_VECTORS if up != right and up != tuple(-c for c in right)]
+ORIENTATION_INDEX = {orientation: index for index, orientation in enumerate(ORIENTATIONS)}
+# Index of the orientation reached by turning the plane in each direction, for every orientation
+TURNS = {
+	'up': [ORIENTATION_INDEX[(cross(up, right), right)] for up, right in ORIENTATIONS],
+	'right': [ORIENTATION_INDEX[(up, cross(up, right))] for up, right in ORIENTATIONS],
+	'down': [ORIENTATION_INDEX[(cross(right, up), right)] for up, right in ORIENTATIONS],
+	'left': [ORIENTATION_INDEX[(up, cross(right, up))] for up, right in ORIENTATIONS],
+}
+# Move of the snake's head in each direction, for every orientation
+STEPS = [{'up': tuple(-c for c in up), 'left': tuple(-c for c in right), 'down': up, 'right': right, None: (0, 0, 0)}
+		 for up, right in ORIENTATIONS]
+# Axis the plane doesn't span, along which its depth is measured
+DEPTH_AXES = [[u == 0 and r == 0 for u, r in zip(up, right)].index(True) for up, right in ORIENTATIONS]
 
 class GameModel(object):
 	"""
 	Stores all information about the current state of the game.
 
 	Data:
-		grid: 3D array containing all of the blocks in the game.
+		grid: GameGrid storing the kind of block in every cell of the game.
 		snake: The snake itself, which stores its own direction and the positions of its component parts.
-		foods: A list of the food objects currently contained in the model.
-		walls: Same as above, for wall objects.
+		foods: A dict of the food objects currently contained in the model, keyed by position.
+		walls: A list of the wall objects in the model, built from the grid when asked for.
 		plane: A plane object containing the state of the current slice the snake is moving in.
+		seed: Seed of the model's random number generator, which places the walls and food, so that a game
+			can be replayed from its seed and commands. Drawn from the global random module if not given.
+		start: Snapshot of the start of the game if keep_start was given or keep_start was called, to restart on
+			the same map. The grid keeps the start kinds of the cells that changed since, see GameGrid.start_kinds.
+
+	A chunked model stores its grid sparsely (see ChunkedGrid), for worlds too wide for a dense cube of cells.
 	"""
-	def __init__(self, dimensions=50):
-		self.grid = GameGrid(dimensions)
-		self.snake = Snake(dimensions/2)
-		self.grid.grid[dimensions/2][dimensions/2][0] = self.snake.head.data
-		self.foods = []
-		self.walls = []
+	def __init__(self, dimensions=50, seed=None, keep_start=False, chunked=False):
+		self.seed = random.randrange(2 ** 32) if seed is None else seed
+		self.random = random.Random(self.seed)
+		self.grid = ChunkedGrid(dimensions) if chunked else GameGrid(dimensions)
+		self.snake = Snake((dimensions//2, dimensions//2, 0))
+		self.grid.set_kind(self.snake.head_position, SNAKE)
+		self.foods = {}
 		self.dead = False
+		self.contact = EMPTY		# Kind of the cell the head moved into on the last move
 		self.plane = Plane()
 		#self.make_random_walls()
 		self.make_blob_walls(6, 9)
 		self.make_food()
 		self.score = 0
 		self.score2 = 0	
-
-	def make_random_walls(self):
-		"""Procedurally generate obstacles in 3 dimensions at the start of the game"""
-		square_dimensions = len(self.grid.grid[0][0])
-		num_blocks = 1000
-		block_length = 200
-		directions = [(1,0,0),(0,1,0),(0,0,1),(-1,0,0),(0,-1,0),(0,0,-1)]
-
-		# Number of block walls
-		for block in range(num_blocks):
-			#print 'block:', block
-			stagnate = 100
-
-			# Select a random start point (that isn't a wall)
-			origin = self.rand_3tuple(0, square_dimensions-1)
-			x,y,z = origin
-
-			# Make sure there is nothing there
-			while self.grid.grid[x][y][z] != None:				
-				origin = self.rand_3tuple(0, square_dimensions-1)
-
-			# Sequentially choose where the next walls will be, add them to the grid and the list of walls
-			block_count = block_length
-			while block_length:
-
-				one_direction = random.choice(directions)
-				n_x,n_y,n_z = tuple(np.add(origin,one_direction) % square_dimensions)
-				cell_content = self.grid.grid[n_x][n_y][n_z]
-
-				for a_wall in self.walls:
-					#print 'wall check'
-					if a_wall == cell_content:
-						origin = (a_wall.x, a_wall.y, a_wall.z) 
-						block_length -= 1
-						stagnate -= 1
-
-				if cell_content == None:
-					origin = (n_x,n_y,n_z)
-					new_wall = Wall(n_x,n_y,n_z)
-					self.walls.append(new_wall)
-					self.grid.grid[n_x][n_y][n_z] = new_wall
-					block_length -= 1
-
-				if stagnate == 0:
-					block_length = 0
-		#print 'Number of Walls:', len(self.walls)
-
-	def make_blob_walls(self, num_blobs, size_blobs):
-		square_dimensions = len(self.grid.grid[0][0])
-		# Generate a bunch of points (blob centers)
-		for a_blob in range(num_blobs):
-			origin = self.rand_3tuple(0, square_dimensions-1)
-
-			# Make sure there is nothing there
-			while self.grid.tuple_get(origin) != None:				
-				origin = self.rand_3tuple(0, square_dimensions-1)
-
-			# Make blobs off of those
-			self.make_blob(origin, 0.6, size_blobs)
-
-		#print len(self.walls)
-
-
-	def make_blob(self, origin, proba, depth):
-		square_dimensions = len(self.grid.grid[0][0])
-
-		#print 'Recursing'
-
-		if depth == 0:
-			#print 'Stopping Condition'
-			return
-
-		directions = [(1,0,0),(0,1,0),(0,0,1),(-1,0,0),(0,-1,0),(0,0,-1)]
-		for one_direction in directions:
-			new_origin = tuple(np.add(origin,one_direction))
-
-		#	print self.grid.tuple_get(new_origin) != None
-		#	print self.tuple_in_range(new_origin, 0, square_dimensions-1)
-		#	print random.random() < proba
-		#	print
-
-
-			if self.tuple_in_range(new_origin, 0, square_dimensions-1) and (self.grid.tuple_get(new_origin) == None) and (random.random() < proba):
-				#print 'Making new wall'
-
-				# Set walls in internal list of walls
-				new_wall = Wall(*new_origin)
-				self.walls.append(new_wall)
-				# Set wall in the grid
-				self.grid.tuple_set(new_origin, Wall(*new_origin))
-				# Recurse
-				#self.make_blob(new_origin, proba*(1-1/float(depth)), depth-1)
-				self.make_blob(new_origin, proba, depth-1)
-
-	def tuple_in_range(self, your_tuple, a, b):
+		self.start = None
+		if keep_start:
+			self.keep_start()
+
+	def make_random_walls(self, num_walks=1000, walk_length=200, seed=None):
+		"""Procedurally generate obstacles in 3 dimensions at the start of the game, as random walks through the cube"""
+		rng = self.terrain_rng(seed)
+		self.grid.mark_filled(terrain.make_random_walks(self.grid.cells, num_walks, walk_length, rng, WALL))
+
+	def make_blob_walls(self, num_blobs, size_blobs, proba=0.6, seed=None):
+		"""Procedurally generate blobs of walls around random points at the start of the game"""
+		rng = self.terrain_rng(seed)
+		self.grid.mark_filled(terrain.make_blobs(self.grid.cells, num_blobs, size_blobs, proba, rng, WALL))
+
+	def terrain_rng(self, seed=None):
+		"""Return a numpy RandomState for terrain generation, seeded from the model's generator unless a seed is given"""
+		return np.random.RandomState(self.random.randrange(2 ** 32) if seed is None else seed)
+
+	@property
+	def walls(self):
+		"""List of the wall objects in the model, built from the grid"""
+		return [Wall(*position) for position in self.grid.positions_of(WALL).tolist()]
+
+	def make_food(self, count=1):
 		"""
-		Return true if each element of the tuple is within the range (a,b) inclusive
+		Generate new food blocks in random empty cells; invoked at start of game or when the snake eats.
+		Picking from the grid's index of free cells takes constant time per food, however full the world is.
 		"""
-		for element in your_tuple:
-			if not (a <= element and element <= b):
-				return False
-		return True
-
-	def make_food(self):
-		"""Generate a new food block in a random location; invoked at start of game or when the snake eats"""
-		def random_point():
-			x = random.randrange(1, len(self.grid.grid) - 1)
-			y = random.randrange(1, len(self.grid.grid[x]) - 1)
-			z = random.randrange(1, len(self.grid.grid[x][y]) - 1)
-			return (x, y, z)
-		point = random_point()
-		while SnakeBodyPart(*point) in self.snake.get_list() or Wall(*point) in self.walls: #Retry if it overlaps with the snake or with a wall block
-			point = random_point()
-		new_food = Food(*point)
-		self.foods.append(new_food)		#Update the model's food list
-		self.grid.grid[point[0]][point[1]][point[2]] = new_food		#Update the grid
-		print point
+		for food in range(count):
+			point = self.grid.random_free_cell(self.random)
+			if point is None:
+				return		# No room left in the world
+			new_food = Food(*point)
+			self.foods[point] = new_food		#Update the model's food index
+			self.grid.tuple_set(point, new_food)		#Update the grid
 
 	def move_snake(self, to_x, to_y, to_z):
 		"""Move the head of the snake to a given point"""
-		if any(x < 0 or x > (len(self.grid.grid) - 1) for x in [to_x, to_y, to_z]):
+		if any(x < 0 or x > (self.grid.dimensions - 1) for x in [to_x, to_y, to_z]):
 			#Wrap the snake around the edge when it reaches a corner
 			self.change_orientation(self.snake.direction)
+			self.contact = EMPTY
 			return
-		# Delete in the grid
-		for part in self.snake.get_list():
-			self.grid.grid[part.x][part.y][part.z] = None
 		# Move snake internally
 		grow = bool(self.snake.growth_counter)		#If the snake is in the process of growing
-		self.snake.move(to_x, to_y, to_z, grow)		#Pass this to the snake's internal move function
+		tail = self.snake.move(to_x, to_y, to_z, grow)		#Pass this to the snake's internal move function
 		if grow:
 			self.snake.growth_counter -= 1
-		# Update in grid
-		for part in self.snake.get_list():
-			self.grid.grid[part.x][part.y][part.z] = part
+		# Update in grid: only the vacated tail cell and the new head change
+		if tail is not None and not self.snake.occupies(tail):
+			self.grid.set_kind(tail, EMPTY)
+		# Remember what the head ran into before overwriting it; check_collision acts on it
+		self.contact = self.grid.kind_at(self.snake.head_position)
+		self.grid.set_kind(self.snake.head_position, SNAKE)
 
 	def update_snake(self):
 		"""Incrementally move the snake in whichever direction it's currently moving"""
 		if self.snake.dead:
 			return
-		x = self.snake.head.data.x
-		y = self.snake.head.data.y
-		z = self.snake.head.data.z
-		position = (x, y, z)
-		#Use the plane's direction vectors to find the snake's next position
-		if self.snake.direction == 'up':
-			new_position = tuple(np.subtract(position, self.plane.up))
-		elif self.snake.direction == 'left':
-			new_position = tuple(np.subtract(position, self.plane.right))
-		elif self.snake.direction == 'down':
-			new_position = tuple(np.add(position, self.plane.up))
-		elif self.snake.direction == 'right':
-			new_position = tuple(np.add(position, self.plane.right))
-		else:
-			new_position = position
-		self.move_snake(*new_position)		#Move the snake to the new position	
+		#Use the plane's precomputed step in the snake's direction to find its next position
+		new_position = vector_add(self.snake.head_position, self.plane.step(self.snake.direction))
+		self.move_snake(*new_position)		#Move the snake to the new position
 
 	def change_orientation(self, direction):
 		"""Re-orient the plane by rotating the view in a given direction"""
-		getattr(self.plane, 'turn_' + direction)()
-		head = self.snake.head.data
-		direction_vector = tuple(np.add(self.plane.up, self.plane.right))
-		position_vector = (head.x, head.y, head.z)
-		#Re-set the depth to the position value of the coordinate not contained in the new direction vector
+		self.plane.turn(direction)
+		#Re-set the depth to the position value of the coordinate not contained in the new plane
 		#(e.g. if in the xy plane, depth is the current z position)
-		depth_index = direction_vector.index(0)
-		depth = position_vector[depth_index]
-		self.plane.depth = depth
+		self.plane.depth = self.snake.head_position[self.plane.depth_axis()]
 
 	def check_collision(self):
 		"""
 		Check if the Snake's head is hitting anything. Act accordingly.
+
+		Walls and foods are found with the grid lookup done when the head moved, and the snake's own
+		occupancy count tells whether it ran into itself, so the cost doesn't depend on the number of blocks.
+		Return a Collision, or None if the head is in an empty cell.
+		"""
+		position = self.snake.head_position
+		if self.snake.collides_with_self():
+			kind = SNAKE
+		elif self.contact in (WALL, FOOD):
+			kind = self.contact
+		else:
+			return None
+		self.contact = EMPTY
+
+		if kind == FOOD:
+			self.snake.grow()
+			del self.foods[position]
+			self.make_food()
+			self.score += 10   # Have the score based off of len(snake)?
+			self.score2 += 10
+		else:
+			self.snake.die()
+		return Collision(kind, position)
+
+	def state_hash(self):
+		"""Return a SHA-1 digest of the state of the game: cells, snake, plane and scores"""
+		snake = self.snake
+		digest = hashlib.sha1(self.grid.cells.tobytes())
+		digest.update(snake.positions().astype(np.int32).tobytes())
+		digest.update(repr((snake.direction, snake.growth_counter, snake.dead, self.plane.orientation, self.plane.depth,
+			self.score, self.score2)).encode('ascii'))
+		return digest.digest()
+
+	def snapshot(self):
+		"""
+		Return a Snapshot of the state of the game, to go back to it with restore.
+		From the first snapshot on, the grid keeps a journal of the cells that change, so that taking a snapshot
+		costs as much as copying the snake, and restoring one as much as undoing the changes made since.
 		"""
-		x = self.snake.head.data.x
-		y = self.snake.head.data.y
-		z = self.snake.head.data.z
-	
-		# Check for wall collision
-		for a_wall in self.walls:
-			if a_wall.x == x and a_wall.y == y and a_wall.z == z:
-				self.snake.die()		
-
-		# Check for food collision
-		for i, apple in enumerate(self.foods):
-			if apple.x == x and apple.y == y and apple.z == z:
-				self.snake.grow()
-				del self.foods[i]
-				self.make_food()
-				self.score += 10   # Have the score based off of len(snake)?
-				self.score2 += 10
-
-		# Check for snake collisions
-		for part in self.snake.get_list()[1:]:		# Don't check against the head
-			if part.x == x and part.y == y and part.z == z:
-				self.snake.die()
-
-	def restart(self):
-		"""Restart the game by re-initializing the model to default values"""
-		self.__init__()
-
-	def rand_3tuple(self, lower, higher):
-		"""Return random 3-tuple (N_0, N_1, N_2) where lower <= N_x <= higher"""
-		return (random.randint(lower, higher),random.randint(lower, higher) ,random.randint(lower, higher))
-	
+		if self.grid.journal is None:
+			self.grid.journal = []
+		return self.save_state(self.grid.journal_length())
+
+	def save_state(self, journal_length=None):
+		"""Return a Snapshot of the state of the game other than its cells"""
+		return Snapshot(journal_length, self.snake.copy(), dict(self.foods), self.plane.orientation, self.plane.depth,
+			self.contact, self.dead, self.score, self.score2, self.random.getstate())
+
+	def keep_start(self):
+		"""
+		Keep the current state as the start of the game, to restart on the same map. Rather than journaling every
+		change of the game, the grid then remembers the kind each cell had at the start, the first time it changes,
+		so that what restarting costs and holds grows with the number of cells changed, not with the ticks played.
+		"""
+		self.start = self.save_state()
+		self.grid.start_kinds = {}
+
+	def restore(self, snapshot):
+		"""Go back to the state of a snapshot. This invalidates the snapshots taken after it"""
+		if snapshot.journal_length > self.grid.journal_length():
+			raise ValueError('snapshot was taken after the state it was restored to')
+		self.grid.undo(snapshot.journal_length)
+		self.restore_state(snapshot)
+
+	def restore_state(self, snapshot):
+		"""Go back to the state of a snapshot other than its cells"""
+		self.snake = snapshot.snake.copy()
+		self.foods = dict(snapshot.foods)
+		self.plane.orientation, self.plane.depth = snapshot.orientation, snapshot.depth
+		self.contact, self.dead, self.score, self.score2 = snapshot.contact, snapshot.dead, snapshot.score, snapshot.score2
+		self.random.setstate(snapshot.random_state)
+
+	def forget(self, snapshot):
+		"""
+		Drop the journal of the changes made before a snapshot, so that it doesn't grow for the whole game when
+		snapshots are taken as it goes. Older snapshots can't be restored afterwards; the start, if kept, still can.
+		"""
+		self.grid.trim_journal(snapshot.journal_length)
+
+	def restart(self, same_map=False):
+		"""
+		Restart the game by re-initializing the model to default values, in a new world of the same size,
+		or on the same map: by writing back the start kinds of the cells changed since the start if it was kept,
+		or else by generating the world again from the model's seed. The free cells of a restored map are indexed
+		in another order, so its food doesn't show up where it did the first time.
+		"""
+		if same_map and self.start is not None and self.grid.start_kinds is not None:
+			self.grid.restore_start()
+			self.restore_state(self.start)
+		else:
+			self.__init__(self.grid.dimensions, self.seed if same_map else None, keep_start=self.start is not None,
+				chunked=isinstance(self.grid, ChunkedGrid))
+
 
 class GameGrid(object):
 	"""
-	Coordinate array that stores the positional data for all of the game blocks
+	Coordinate array that stores the kind of block (EMPTY, SNAKE, FOOD or WALL) in every cell of the game.
+
+	Data:
+		cells: uint8 array of shape (dimensions, dimensions, dimensions) indexed by [x, y, z].
+		grid: Lazy view of the cells as Block instances (or None), indexable as grid[x][y][z].
+		free: Ids of the empty cells (see cell_id) in its first free_count entries, in no particular order.
+		free_slot: Index in free of every empty cell, so cells can be swap-removed from it in constant time.
+		lines: LineIndex of the occupied cells of every line of the cube, from which planes are projected.
+			Built by line_index when first asked for, so that models that are never drawn don't maintain it.
+		journal: None, or once GameModel.snapshot was called, a list of the changes made through set_kind and
+			the bulk updates of the free cell index, undone by undo.
+		journal_start: Number of the oldest changes dropped from the journal by trim_journal; journal lengths
+			count them, so that the lengths saved in snapshots stay valid.
+		start_kinds: None, or once GameModel.keep_start was called, a dict of the kind every cell written since
+			had at the start, restored by restore_start. None again after writes it can't follow (rebuild_free_index).
+		dirty: None, or once a SlicePipeline tracks the grid, the set of the positions of the cells written since
+			it last took them. Bulk writes set it back to None, so that the pipeline copies all the cells again.
+
+	Cells must be written through set_kind or tuple_set to keep the index of free cells up to date.
+	After writing to cells directly, call mark_filled with the cells that were filled, or rebuild_free_index.
 	"""
 	def __init__(self, dimensions):
-		self.grid = np.array([[[None for z in range(dimensions)] for y in range(dimensions)] for x in range(dimensions)])
-				
+		self.dimensions = dimensions
+		self.cells = np.zeros((dimensions, dimensions, dimensions), dtype=np.uint8)
+		self.grid = BlockView(self)
+		self.free = np.arange(dimensions ** 3, dtype=np.int32)
+		self.free_slot = np.arange(dimensions ** 3, dtype=np.int32)
+		self.free_count = dimensions ** 3
+		self.lines = None
+		self.journal = None
+		self.journal_start = 0
+		self.start_kinds = None
+		self.dirty = None
+
 	def __repr__(self):
-		repr_string = ''
-		for i in range(len(self.grid)):
-			repr_string += str(self.grid[i])
-			if i != len(self.grid) - 1:
-				repr_string += ('\n')
-		return repr_string
+		return str(self.cells)
+
+	def kinds(self):
+		"""Return the uint8 array holding the kind of every cell"""
+		return self.cells
+
+	def kind_at(self, xyz):
+		"""Return the kind of the cell at a given position"""
+		return self.cells[tuple(xyz)]
+
+	def positions_of(self, kind):
+		"""Return the positions of all the cells of a kind, as an array of shape (count, 3)"""
+		return np.argwhere(self.cells == kind)
+
+	def set_kind(self, xyz, kind):
+		xyz = tuple(xyz)
+		old_kind = self.cells[xyz]
+		slot = None		# Slot of the cell in the free index if it leaves it, -1 if it joins it
+		if old_kind == EMPTY and kind != EMPTY:
+			slot = self.free_slot[self.cell_id(xyz)]
+			self.remove_free(self.cell_id(xyz))
+		elif old_kind != EMPTY and kind == EMPTY:
+			slot = -1
+			self.add_free(self.cell_id(xyz))
+		self.cells[xyz] = kind
+		self.update_lines(xyz, old_kind, kind)
+		if self.journal is not None:
+			self.journal.append((xyz, old_kind, slot))
+		if self.start_kinds is not None and xyz not in self.start_kinds:
+			self.start_kinds[xyz] = old_kind
+		if self.dirty is not None:
+			self.dirty.add(xyz)
+
+	def line_index(self):
+		"""Return the LineIndex of the cells, building it the first time, or None if the grid is too narrow to need one"""
+		if self.lines is None and self.dimensions >= LINE_INDEX_WIDTH:
+			self.lines = LineIndex(self.cells)
+		return self.lines
+
+	def update_lines(self, xyz, old_kind, kind):
+		"""Keep the line index, if any, up to date after a cell changed from one kind to another"""
+		if self.lines is not None and (old_kind == EMPTY) != (kind == EMPTY):
+			self.lines.changed(xyz)
+
+	def restore_start(self):
+		"""Write back the kinds the cells had when start_kinds started collecting them"""
+		start_kinds, self.start_kinds = self.start_kinds, None
+		for xyz, kind in start_kinds.items():
+			self.set_kind(xyz, kind)
+		self.start_kinds = {}
+
+	def remember_filled(self, positions):
+		"""Keep the start kind of cells that were empty and are filled in bulk"""
+		if self.start_kinds is not None:
+			for xyz in map(tuple, np.asarray(positions).tolist()):
+				self.start_kinds.setdefault(xyz, EMPTY)
+
+	def journal_length(self):
+		"""Return the number of changes journaled so far, including the ones trimmed"""
+		return self.journal_start + len(self.journal or [])
+
+	def trim_journal(self, journal_length):
+		"""Drop the changes of the journal before its first journal_length entries, which can then no longer be undone"""
+		count = journal_length - self.journal_start
+		if count > 0:
+			del self.journal[:count]
+			self.journal_start = journal_length
+
+	def undo(self, journal_length):
+		"""Undo the changes of the journal beyond its first journal_length entries, newest first"""
+		journal = self.journal
+		if journal_length < self.journal_start:
+			raise ValueError('cannot undo changes trimmed from the journal')
+		journal_length -= self.journal_start
+		if None in journal[journal_length:]:
+			raise ValueError('cannot undo past a rebuild_free_index')
+		while len(journal) > journal_length:
+			entry = journal.pop()
+			if entry[0] is None:
+				self.undo_mark_filled(*entry[1:])
+				continue
+			xyz, old_kind, slot = entry
+			if slot == -1:
+				self.free_count -= 1		# The cell was appended to the free index
+			elif slot is not None:
+				# The cell was swap-removed: move the cell that took its slot back to the end
+				moved = self.free[slot]
+				self.free[self.free_count] = moved
+				self.free_slot[moved] = self.free_count
+				self.free[slot] = self.cell_id(xyz)
+				self.free_slot[self.cell_id(xyz)] = slot
+				self.free_count += 1
+			kind = self.cells[xyz]
+			self.cells[xyz] = old_kind
+			self.update_lines(xyz, kind, old_kind)
+			if self.dirty is not None:
+				self.dirty.add(xyz)
+
+	def undo_mark_filled(self, cell_ids, tail, old_count):
+		"""Empty the cells filled by a call to mark_filled and put the free index back as it was before it"""
+		self.cells.flat[cell_ids] = EMPTY
+		count = old_count - len(tail)
+		self.free[count:old_count] = tail
+		self.free_slot[tail] = np.arange(count, old_count, dtype=np.int32)
+		slots = self.free_slot[cell_ids]		# Left untouched by mark_filled
+		self.free[slots[slots < count]] = cell_ids[slots < count]
+		self.free_count = old_count
+		self.dirty = None
+		if self.lines is not None:
+			self.lines.refresh(np.column_stack(np.unravel_index(cell_ids, self.cells.shape)))
+
+	def cell_id(self, xyz):
+		"""Return the index of a cell in the flattened grid"""
+		x, y, z = xyz
+		return (x * self.dimensions + y) * self.dimensions + z
+
+	def cell_position(self, cell_id):
+		"""Inverse of cell_id"""
+		x, yz = divmod(cell_id, self.dimensions * self.dimensions)
+		y, z = divmod(yz, self.dimensions)
+		return (x, y, z)
+
+	def add_free(self, cell_id):
+		self.free[self.free_count] = cell_id
+		self.free_slot[cell_id] = self.free_count
+		self.free_count += 1
+
+	def remove_free(self, cell_id):
+		"""Remove a cell from the index of free cells by moving the last free cell into its slot"""
+		slot = self.free_slot[cell_id]
+		last = self.free[self.free_count - 1]
+		self.free[slot] = last
+		self.free_slot[last] = slot
+		self.free_count -= 1
+
+	def rebuild_free_index(self):
+		"""
+		Recompute the index of free cells from scratch, after writing to cells directly.
+		Snapshots can't be restored past this, nor can the start
+		"""
+		if self.journal is not None:
+			self.journal.append(None)
+		self.start_kinds = None
+		free = np.flatnonzero(self.cells.ravel() == EMPTY).astype(np.int32)
+		self.free_count = len(free)
+		self.free[:self.free_count] = free
+		self.free_slot[free] = np.arange(self.free_count, dtype=np.int32)
+		self.dirty = None
+		if self.lines is not None:
+			self.lines.rebuild()
+
+	def mark_filled(self, positions):
+		"""
+		Remove cells that used to be empty from the index of free cells and count them in the line index,
+		after writing to cells directly.
+		All of them are removed at once by moving the free cells at the end of the index into their slots.
+		"""
+		self.remember_filled(positions)
+		cell_ids = np.ravel_multi_index(np.transpose(positions), self.cells.shape)
+		slots = self.free_slot[cell_ids]
+		count = self.free_count - len(slots)
+		if self.journal is not None:
+			self.journal.append((None, cell_ids, self.free[count:self.free_count].copy(), self.free_count))
+		leaving = np.zeros(self.free_count - count, dtype=bool)
+		leaving[slots[slots >= count] - count] = True
+		moving = self.free[count:self.free_count][~leaving]
+		holes = slots[slots < count]
+		self.free[holes] = moving
+		self.free_slot[moving] = holes
+		self.free_count = count
+		self.dirty = None
+		if self.lines is not None:
+			self.lines.refresh(positions)
+
+	def random_free_cell(self, rng=random):
+		"""Return the position of a random empty cell, picked with a given random generator, or None if the grid is full"""
+		if self.free_count == 0:
+			return None
+		return self.cell_position(int(self.free[rng.randrange(self.free_count)]))
 
 	def tuple_get(self, xyz):
-		x, y, z = xyz
-		return self.grid[x][y][z]
+		"""Return a Block instance for the contents of a cell, or None if it is empty"""
+		kind = self.cells[tuple(xyz)]
+		if kind == EMPTY:
+			return None
+		return BLOCK_TYPES[kind](*xyz)
 
 	def tuple_set(self, xyz, value):
-		x, y, z = xyz
-		self.grid[x][y][z] = value
-		return
+		"""Store a Block instance (or None to empty the cell) at a given position"""
+		self.set_kind(xyz, EMPTY if value is None else value.kind)
+
+
+class ChunkedGrid(GameGrid):
+	"""
+	GameGrid storing its cells sparsely, as ChunkedCells: memory grows with the chunks that hold blocks
+	rather than with the cube of the width, so worlds can be a thousand cells wide.
+
+	It has no index of free cells. random_free_cell samples random cells until it finds an empty one instead,
+	which takes few tries as long as the world is mostly empty, as wide worlds are.
+	"""
+	def __init__(self, dimensions, chunk_size=CHUNK):
+		self.dimensions = dimensions
+		self.cells = ChunkedCells(dimensions, chunk_size)
+		self.grid = BlockView(self)
+		self.lines = None
+		self.journal = None
+		self.journal_start = 0
+		self.start_kinds = None
+		self.dirty = None
+
+	def __repr__(self):
+		return 'ChunkedGrid(%d, %d chunks)' % (self.dimensions, len(self.cells.chunks))
+
+	def positions_of(self, kind):
+		positions = self.cells.nonzero()
+		return positions[self.cells.kinds_at(positions) == kind]
+
+	def set_kind(self, xyz, kind):
+		xyz = tuple(xyz)
+		if self.journal is not None:
+			self.journal.append((xyz, self.cells[xyz], None))
+		if self.start_kinds is not None and xyz not in self.start_kinds:
+			self.start_kinds[xyz] = self.cells[xyz]
+		self.cells[xyz] = kind
+		if self.dirty is not None:
+			self.dirty.add(xyz)
+
+	def line_index(self):
+		"""The chunks keep their own summaries for projections instead of a LineIndex"""
+		return None
+
+	def update_lines(self, xyz, old_kind, kind):
+		pass
+
+	def undo_mark_filled(self, positions):
+		self.cells[tuple(np.transpose(positions))] = EMPTY
+		self.dirty = None
+
+	def rebuild_free_index(self):
+		"""There is no index of free cells to rebuild. Snapshots and the start can't be restored past direct writes to the cells"""
+		if self.journal is not None:
+			self.journal.append(None)
+		self.start_kinds = None
+		self.dirty = None
+
+	def mark_filled(self, positions):
+		"""Only journal the cells that were filled, so that snapshots can empty them again"""
+		self.remember_filled(positions)
+		if self.journal is not None:
+			self.journal.append((None, np.asarray(positions)))
+		self.dirty = None
+
+	def random_free_cell(self, rng=random, tries=1000):
+		"""Return the position of a random empty cell, picked with a given random generator, or None if none was found"""
+		for attempt in range(tries):
+			xyz = (rng.randrange(self.dimensions), rng.randrange(self.dimensions), rng.randrange(self.dimensions))
+			if self.cells[xyz] == EMPTY:
+				return xyz
+		return None
+
+
+class BlockView(object):
+	"""
+	Lazy view of a GameGrid for callers that still want Block instances.
+	Indexing it three times (view[x][y][z]) builds the block for that cell on demand.
+	"""
+	def __init__(self, grid, index=()):
+		self.game_grid = grid
+		self.index = index
+
+	def __len__(self):
+		return self.game_grid.dimensions
+
+	def __getitem__(self, i):
+		index = self.index + (i,)
+		if len(index) == 3:
+			return self.game_grid.tuple_get(index)
+		return BlockView(self.game_grid, index)
+
+	def __setitem__(self, i, value):
+		index = self.index + (i,)
+		if len(index) != 3:
+			raise TypeError('Only single cells of the grid can be assigned')
+		self.game_grid.tuple_set(index, value)
 
 
 class Plane(object):
 	"""
 	Stores information about the slice of the grid with the snake's current position. 
 	Contains methods for rotating itself in all four directions.
+
+	The orientation is stored as an index into ORIENTATIONS, so turning and finding the snake's
+	next step are lookups into the precomputed TURNS and STEPS tables.
 	"""
-	def __init__(self):
-		self.up = (0, -1, 0) 	#default 'up' direction is -y
-		self.right = (1, 0, 0)  #default 'right' direction is +x
-		self.depth = 0
+	def __init__(self, up=(0, -1, 0), right=(1, 0, 0), depth=0):
+		#default 'up' direction is -y, default 'right' direction is +x
+		self.orientation = ORIENTATION_INDEX[(up, right)]
+		self.depth = depth
+
+	@property
+	def up(self):
+		return ORIENTATIONS[self.orientation][0]
+
+	@property
+	def right(self):
+		return ORIENTATIONS[self.orientation][1]
+
+	def depth_axis(self):
+		return DEPTH_AXES[self.orientation]
+
+	def step(self, direction):
+		"""Return the vector the snake moves by in a given direction ('up', 'left', 'down', 'right' or None)"""
+		return STEPS[self.orientation][direction]
+
+	def turn(self, direction):
+		self.orientation = TURNS[direction][self.orientation]
 
 	def turn_up(self):
-		self.up = tuple(np.cross(self.up, self.right))
+		self.turn('up')
 
 	def turn_right(self):
-		self.right = tuple(np.cross(self.up, self.right))
+		self.turn('right')
 
 	def turn_down(self):
-		self.up = tuple(np.cross(self.right, self.up))
+		self.turn('down')
 
 	def turn_left(self):
-		self.right = tuple(np.cross(self.right, self.up))
+		self.turn('left')
 
 
-class Snake(LinkedList):
+class Snake(object):
 	"""
-	Contains all of the individual snake components, as well as information about its own direction and state of growth.
-	The snake's head is stored as the head of a linked list.
+	Contains the positions of all of the snake's parts, as well as information about its own direction and state of growth.
+
+	The positions are stored head first in a ring buffer that doubles in size when full, so moving the head,
+	dropping the tail and getting the length are constant time. A count of parts per occupied cell
+	makes self-collision checks constant time as well.
 	"""
-	def __init__(self, position, direction=None, growth_rate=4):
-		head = Node(SnakeBodyPart(position, position, z=0))
-		super(Snake, self).__init__(head)
+	def __init__(self, position, direction=None, growth_rate=4, capacity=64):
+		self.body = np.zeros((capacity, 3), dtype=np.int32)
+		self.start = 0		# Index of the head in the ring buffer
+		self.length = 1
+		self.body[0] = position
+		self.head_position = tuple(int(c) for c in position)
+		self.occupied = {self.head_position: 1}
 		self.direction = direction
 		self.growth_counter = 0
 		self.growth_rate = growth_rate
 		self.dead = False
 
+	def __len__(self):
+		return self.length
+
+	def size(self):
+		return self.length
+
+	def positions(self):
+		"""Return an array of the positions of all the parts of the snake, from head to tail"""
+		indices = (self.start + np.arange(self.length)) % len(self.body)
+		return self.body[indices]
+
+	def get_list(self):
+		"""Return SnakeBodyPart blocks for all the parts of the snake, from head to tail"""
+		return [SnakeBodyPart(*position) for position in self.positions().tolist()]
+
+	def tail_position(self):
+		return tuple(self.body[(self.start + self.length - 1) % len(self.body)].tolist())
+
+	def occupies(self, xyz):
+		"""Return whether any part of the snake is in a given cell"""
+		return xyz in self.occupied
+
+	def collides_with_self(self):
+		"""Return whether the head shares its cell with another part of the snake"""
+		return self.occupied[self.head_position] > 1
+
 	def change_direction(self, new_direction):
 		"""Checks if a direction change is legal and acts on it if appropriate"""
-		opposites = {'up': 'down',
-					 'left': 'right',
-					 'down': 'up',
-					 'right': 'left',
-					 None: None}
-		if new_direction != opposites[self.direction] or self.size() == 1:
+		if new_direction != OPPOSITES[self.direction] or self.length == 1:
 			self.direction = new_direction
 
 	def move(self, to_x, to_y, to_z, eaten=False):
-		"""Move the snake head to a given set of coordinates by creating a new head"""
-		# Move internally
-		new_head = SnakeBodyPart(to_x, to_y, to_z)
-		self.insert(new_head)
-		if not eaten:
-			self.delete() 	#Shift the rest of the snake forward by deleting the tail.
-							#If the snake has eaten, allow it to grow by just moving the head forward.
+		"""
+		Move the snake head to a given set of coordinates.
+		Return the position of the tail that was dropped, or None if the snake has eaten and grew instead.
+		"""
+		if self.length == len(self.body):
+			self.body = np.concatenate((self.positions(), np.zeros_like(self.body)))
+			self.start = 0
+		self.start = (self.start - 1) % len(self.body)
+		self.head_position = (int(to_x), int(to_y), int(to_z))
+		self.body[self.start] = self.head_position
+		self.occupied[self.head_position] = self.occupied.get(self.head_position, 0) + 1
+		self.length += 1
+		if eaten:
+			return None
+		#Shift the rest of the snake forward by dropping the tail.
+		#If the snake has eaten, allow it to grow by just moving the head forward.
+		tail = self.tail_position()
+		self.length -= 1
+		if self.occupied[tail] == 1:
+			del self.occupied[tail]
+		else:
+			self.occupied[tail] -= 1
+		return tail
+
 	def grow(self):
 		"""Respond to the snake eating a food block by initializing an increase in length"""
 		self.growth_counter += self.growth_rate
@@ -319,29 +697,55 @@ class Snake(LinkedList):
 		"""Pretty self-explanatory"""
 		self.dead = True
 
+	def copy(self):
+		"""Return an independent copy of the snake"""
+		snake = copy.copy(self)
+		snake.body = self.body.copy()
+		snake.occupied = dict(self.occupied)
+		return snake
+
 
 class Block(object):
 	"""
 	Generic block object.
+
+	Blocks have slots instead of a __dict__, so each costs only its three coordinates, and compare and hash
+	by kind and position: two blocks of the same kind in the same cell are equal.
 	"""
+	__slots__ = ('x', 'y', 'z')
+	kind = EMPTY
+
 	def __init__(self, x, y, z):
 		self.x, self.y, self.z = (x, y, z)
 
+	def __eq__(self, other):
+		return isinstance(other, Block) and self.kind == other.kind and (self.x, self.y, self.z) == (other.x, other.y, other.z)
+
+	def __ne__(self, other):
+		return not self == other
+
+	def __hash__(self):
+		return hash((self.x, self.y, self.z))
+
 
 class SnakeBodyPart(Block):
 	"""
 	Snake component block to be stored in the grid or contained in a Snake object.
 	"""
-	color = pygame.Color('green')
-	dead_color = pygame.Color(78, 78, 78, 255)
-	background_color = pygame.Color(78, 78, 78, 100)
+	__slots__ = ()
+	kind = SNAKE
+	color = (0, 255, 0, 255)		# RGBA, usable anywhere pygame takes a color
+	dead_color = (78, 78, 78, 255)
+	background_color = (78, 78, 78, 100)
 
 
 class Food(Block):
 	"""A food block with its own position and color data, to be stored in the model and in the grid"""
-	color = pygame.Color('yellow')
-	dead_color = pygame.Color(210, 210, 210, 255)
-	background_color = pygame.Color(210, 210, 210, 100)
+	__slots__ = ()
+	kind = FOOD
+	color = (255, 255, 0, 255)
+	dead_color = (210, 210, 210, 255)
+	background_color = (210, 210, 210, 100)
 
 	def __repr__(self):
 		return 'Food'
@@ -349,17 +753,32 @@ class Food(Block):
 
 class Wall(Block):
 	"""Wall block, used in the same manner as a food block"""
-	color = pygame.Color('red')
-	dead_color = pygame.Color(128, 128, 128, 255)
-	background_color = pygame.Color(128, 128, 128, 100)
+	__slots__ = ()
+	kind = WALL
+	color = (255, 0, 0, 255)
+	dead_color = (128, 128, 128, 255)
+	background_color = (128, 128, 128, 100)
 
 	def __repr__(self):
 		return 'Wall'
 
 
 class BackgroundObject(object):
-	"""A mostly stateless object to be placed in the grid to represent an object outside of the current plane."""
-	def __init__(self, block):
-		"""Set this block's color based on the background color of the original block, so the view function can use it"""
-		self.color = block.background_color
+	"""
+	A stateless object to be placed in the grid to represent an object outside of the current plane.
+	It is a flyweight: there is one per kind of block, which BackgroundObject(block) returns for every block of that kind.
+	"""
+	__slots__ = ('color', 'kind')
+	shared = {}		# Kind of block -> its BackgroundObject
+
+	def __new__(cls, block):
+		"""Return the background object of the block's kind, with its background color, creating it the first time"""
+		background = cls.shared.get(block.kind)
+		if background is None:
+			background = cls.shared[block.kind] = super(BackgroundObject, cls).__new__(cls)
+			background.color = block.background_color
+			background.kind = block.kind | BACKGROUND
+		return background
+
 
+BLOCK_TYPES = {SNAKE: SnakeBodyPart, FOOD: Food, WALL: Wall}
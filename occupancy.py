@@ -0,0 +1,98 @@
+"""
+Occupancy of the lines of a dense cube of cells, kept up to date as cells are written.
+
+For every axis, a LineIndex holds, for each line of cells along that axis, how many of its cells are occupied
+(non-zero) and the indices of the two highest occupied ones. The background of a plane at some depth is the
+highest occupied cell of each line along the depth axis, other than the one at that depth, so it is always
+one of the two: projecting a plane reads these arrays instead of the whole cube.
+
+Writes only queue the cells that changed, which costs next to nothing per tick. The lines through them are
+recomputed in one batch of array operations when the index is read, or when the queue gets long.
+"""
+import numpy as np
+
+
+class LineIndex(object):
+	"""
+	Data:
+		counts: for each axis, (n, n) int32 array of the number of occupied cells of the lines along that axis.
+		tops: for each axis, (n, n, 2) int32 array of the highest and second highest indices of occupied cells
+			of the lines along that axis, -1 where there are fewer.
+		pending: cells changed since the arrays were last brought up to date; call flush before reading them.
+	Both arrays are indexed by the coordinates of the lines along the two other axes, in increasing axis order.
+	"""
+	def __init__(self, cells, flush_at=4096):
+		dimensions = cells.shape[0]
+		self.cells = cells
+		self.pending = []
+		self.flush_at = flush_at
+		self.counts = [np.zeros((dimensions, dimensions), dtype=np.int32) for axis in range(3)]
+		self.tops = [np.full((dimensions, dimensions, 2), -1, dtype=np.int32) for axis in range(3)]
+		if cells.any():
+			self.rebuild()
+
+	def rebuild(self):
+		"""
+		Recompute everything from the cells. Only the occupied cells are sorted into their lines, so that worlds
+		of mostly empty space are indexed in one quick scan of the cube
+		"""
+		self.pending = []
+		dimensions = self.cells.shape[0]
+		positions = np.unravel_index(occupied_cell_ids(self.cells), self.cells.shape)
+		for axis in range(3):
+			u, v = [positions[other] for other in range(3) if other != axis]
+			lines, indices = u * dimensions + v, positions[axis]
+			order = np.lexsort((indices, lines))
+			lines, indices = lines[order], indices[order]
+			self.counts[axis][...] = np.bincount(lines, minlength=dimensions * dimensions).reshape(dimensions, dimensions)
+			# The last cell of every line in the sorted order is its highest, and the one before it the second highest
+			last = np.flatnonzero(np.append(lines[1:] != lines[:-1], True))
+			second = last[last > 0]
+			second = second[lines[second - 1] == lines[second]]
+			tops = self.tops[axis].reshape(-1, 2)
+			tops[...] = -1
+			tops[lines[last], 0] = indices[last]
+			tops[lines[second], 1] = indices[second - 1]
+
+	def refresh(self, positions):
+		"""Recompute the lines through an array of positions of shape (count, 3), after writing to them"""
+		positions = np.asarray(positions).reshape(-1, 3)
+		dimensions = self.cells.shape[0]
+		for axis in range(3):
+			u, v = [positions[:, other] for other in range(3) if other != axis]
+			u, v = np.divmod(np.unique(u * dimensions + v), dimensions)
+			lines = np.moveaxis(self.cells, axis, -1)[u, v] != 0
+			self.counts[axis][u, v] = lines.sum(axis=-1)
+			self.tops[axis][u, v] = top_two(lines)
+
+	def changed(self, xyz):
+		"""Queue a cell that became occupied or empty, to refresh the lines through it before they are read"""
+		self.pending.append(xyz)
+		if len(self.pending) >= self.flush_at:
+			self.flush()
+
+	def flush(self):
+		"""Refresh the lines through the queued cells"""
+		if self.pending:
+			positions, self.pending = self.pending, []
+			self.refresh(positions)
+
+
+def occupied_cell_ids(cells):
+	"""Return the flat indices of the non-zero cells of an array, skipping zero bytes eight at a time where it can"""
+	flat = cells.reshape(-1)
+	if flat.size % 8 or not flat.flags.c_contiguous:
+		return np.flatnonzero(flat)
+	words = np.flatnonzero(flat.view(np.uint64))
+	word_index, byte_index = np.nonzero(flat.reshape(-1, 8)[words])
+	return words[word_index] * 8 + byte_index
+
+
+def top_two(occupied):
+	"""Return the two highest indices of occupied cells along the last axis of a boolean array (-1 if missing), stacked last"""
+	size = occupied.shape[-1]
+	reversed_lines = occupied[..., ::-1]
+	first = np.where(occupied.any(axis=-1), size - 1 - np.argmax(reversed_lines, axis=-1), -1)
+	below = occupied & (np.arange(size) < first[..., None])
+	second = np.where(below.any(axis=-1), size - 1 - np.argmax(below[..., ::-1], axis=-1), -1)
+	return np.stack((first, second), axis=-1)
@@ -0,0 +1,124 @@
+"""
+Prepare the images of the frames on a worker thread, so that a slow slice doesn't hold up the game loop.
+
+The main thread submits the state of the model after it changes and blits whichever frame the worker finished
+last. A request is an immutable snapshot of what the worker needs: the plane, the score and the cells written
+since the previous request, with their kinds, or a copy of all the cells the first time and after bulk writes.
+The worker applies the changes to its own copy of the cells, projects the plane from it with its own LineIndex
+and maps the kinds to colors. The array work is done by numpy, which releases the GIL while it runs.
+
+Requests wait in a queue of bounded depth. When it is full, the frame is dropped: its changes stay in the grid's
+dirty set and go with the next request. Frames finished while an even newer one was waiting to be shown are
+skipped. Both are counted, see metrics.
+"""
+import time
+import threading
+from collections import namedtuple
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+import numpy as np
+from model import LINE_INDEX_WIDTH
+from occupancy import LineIndex
+import projection
+
+# cells is a copy of all the cells or None, in which case positions and kinds are the cells written since the last request
+FrameRequest = namedtuple('FrameRequest', ['number', 'cells', 'positions', 'kinds', 'up', 'right', 'depth', 'dead', 'score', 'time'])
+Frame = namedtuple('Frame', ['number', 'rgb', 'dead', 'score', 'time', 'seconds'])
+
+
+class SlicePipeline(object):
+    """
+    Turns the states of a model into RGB images of their plane on a worker thread.
+
+    Data:
+        palette: uint8 array of RGB colors indexed by [dead][kind], like ArrayGameView.rgb_palette.
+        requests: queue of FrameRequests waiting for the worker, at most depth of them.
+        results: queue of the Frames the worker finished.
+        grid: the grid whose writes are being tracked through its dirty set.
+    """
+    def __init__(self, palette, depth=2):
+        self.palette = palette
+        self.requests = queue.Queue(depth)
+        self.results = queue.Queue()
+        self.grid = None
+        self.number = 0
+        self.cells = None  # The worker's copy of the cells, and its LineIndex
+        self.lines = None
+        self.counts = {'submitted': 0, 'dropped': 0, 'skipped': 0, 'shown': 0}
+        self.worker_seconds = 0.0
+        self.latency_seconds = 0.0
+        self.thread = threading.Thread(target=self.work, name='SlicePipeline')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, model):
+        """Queue a frame of the current state of a model. Return False if it was dropped because the queue was full"""
+        if self.requests.full():
+            self.counts['dropped'] += 1
+            return False
+        grid = model.grid
+        cells = positions = kinds = None
+        if grid is not self.grid or grid.dirty is None:
+            cells = grid.kinds().copy()
+            self.grid = grid
+        elif grid.dirty:
+            positions = np.array(list(grid.dirty), dtype=np.intp)
+            kinds = grid.kinds()[tuple(positions.T)]
+        grid.dirty = set()
+        plane = model.plane
+        self.number += 1
+        self.requests.put(FrameRequest(self.number, cells, positions, kinds, plane.up, plane.right, plane.depth,
+                                       model.snake.dead, model.score2, time.time()))
+        self.counts['submitted'] += 1
+        return True
+
+    def latest(self):
+        """Return the newest Frame finished since the last call, or None if there is none"""
+        frame = None
+        while True:
+            try:
+                newer = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if frame is not None:
+                self.counts['skipped'] += 1
+            frame = newer
+        if frame is not None:
+            self.counts['shown'] += 1
+            self.latency_seconds += time.time() - frame.time
+        return frame
+
+    def work(self):
+        """Prepare the frames of the requests as they come, until a None request"""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            start = time.time()
+            if request.cells is not None:
+                self.cells = request.cells
+                dense = isinstance(self.cells, np.ndarray) and self.cells.shape[0] >= LINE_INDEX_WIDTH
+                self.lines = LineIndex(self.cells) if dense else None
+            elif request.positions is not None:
+                self.cells[tuple(request.positions.T)] = request.kinds
+                if self.lines is not None:
+                    self.lines.refresh(request.positions)
+            kinds = projection.project(self.cells, request.up, request.right, request.depth, self.lines)
+            rgb = self.palette[int(request.dead)][kinds]
+            seconds = time.time() - start
+            self.worker_seconds += seconds
+            self.results.put(Frame(request.number, rgb, request.dead, request.score, request.time, seconds))
+
+    def metrics(self):
+        """Return the counts of submitted, dropped, skipped and shown frames, and mean worker and latency times in ms"""
+        metrics = dict(self.counts)
+        metrics['worker_ms'] = 1000.0 * self.worker_seconds / max(self.counts['submitted'], 1)
+        metrics['latency_ms'] = 1000.0 * self.latency_seconds / max(self.counts['shown'], 1)
+        return metrics
+
+    def close(self):
+        """Stop the worker once it has finished the requests already queued"""
+        self.requests.put(None)
+        self.thread.join()
@@ -0,0 +1,104 @@
+"""
+Per-tick timing of the model, view and controller phases of the game loop.
+
+A Profiler replaces methods of the game objects with timed versions of themselves, so nothing is measured,
+and nothing costs anything, unless it has been instrumented. It keeps the durations of the last samples of
+every phase, reports percentiles, feeds the on-screen overlay of GameView, and dumps to JSON or CSV.
+"""
+import csv
+import json
+import functools
+from collections import deque
+from timeit import default_timer
+
+# Methods timed by instrument_game, as (attribute of the game, method, phase)
+GAME_PHASES = [
+    ('model', 'update_snake', 'model.update'),
+    ('model', 'check_collision', 'model.collision'),
+    ('controller', 'handle_event', 'controller.event'),
+    ('view', 'draw', 'view.draw'),
+    ('view', 'get_slice', 'view.slice'),
+    ('view', 'print_score', 'view.score'),
+    ('view', 'print_death_text', 'view.death'),
+]
+
+
+class Profiler(object):
+    """Collects the durations, in seconds, of the last window samples of every phase"""
+    def __init__(self, window=300):
+        self.window = window
+        self.samples = {}
+        self.frame_start = None
+
+    def record(self, phase, seconds):
+        if phase not in self.samples:
+            self.samples[phase] = deque(maxlen=self.window)
+        self.samples[phase].append(seconds)
+
+    def instrument(self, obj, method, phase):
+        """Replace a method of an object (not of its class) with a version of it that records its duration"""
+        original = getattr(obj, method)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(phase, default_timer() - start)
+        setattr(obj, method, timed)
+
+    def instrument_game(self, model, view, controller):
+        """Time the phases of GAME_PHASES, and show the figures in the view's overlay"""
+        game = {'model': model, 'view': view, 'controller': controller}
+        for name, method, phase in GAME_PHASES:
+            self.instrument(game[name], method, phase)
+        view.overlay = self.overlay_lines
+
+    def start_frame(self):
+        self.frame_start = default_timer()
+
+    def end_frame(self):
+        """Record the time since start_frame as a frame, i.e. the work of the loop without the frame rate cap's sleep"""
+        if self.frame_start is not None:
+            self.record('frame', default_timer() - self.frame_start)
+            self.frame_start = None
+
+    def percentile(self, phase, fraction):
+        """Return the duration below which a fraction of the samples of a phase are, by the nearest rank"""
+        ordered = sorted(self.samples[phase])
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+    def summary(self):
+        """Return {phase: {'count', 'mean', 'p50', 'p95', 'p99'}} with the durations in milliseconds"""
+        summary = {}
+        for phase, samples in self.samples.items():
+            if not samples:
+                continue
+            summary[phase] = {'count': len(samples), 'mean': 1000.0 * sum(samples) / len(samples)}
+            for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99)):
+                summary[phase][name] = 1000.0 * self.percentile(phase, fraction)
+        return summary
+
+    def overlay_lines(self):
+        """Return lines of text with the median and 95th percentile of the frame, model and view phases"""
+        summary = self.summary()
+        lines = []
+        for phases in (('frame', 'view.draw'), ('model.update', 'model.collision')):
+            parts = ['%s %.1f/%.1f' % (phase.split('.')[-1], summary[phase]['p50'], summary[phase]['p95'])
+                     for phase in phases if phase in summary]
+            if parts:
+                lines.append('  '.join(parts) + ' ms')
+        return lines
+
+    def dump(self, path):
+        """Write the summary to a file, as CSV if its name ends with .csv and as JSON otherwise"""
+        summary = self.summary()
+        with open(path, 'w') as output:
+            if path.endswith('.csv'):
+                writer = csv.writer(output)
+                writer.writerow(['phase', 'count', 'mean', 'p50', 'p95', 'p99'])
+                for phase in sorted(summary):
+                    writer.writerow([phase] + [summary[phase][name] for name in ('count', 'mean', 'p50', 'p95', 'p99')])
+            else:
+                json.dump(summary, output, indent=2, sort_keys=True)
@@ -0,0 +1,119 @@
+import numpy as np
+from model import EMPTY, BACKGROUND, ORIENTATIONS
+from chunks import ChunkedCells, line_tops
+
+
+def planes():
+    """Return every valid (up, right) pair of a Plane, i.e. all 24 orientations of the cube"""
+    return list(ORIENTATIONS)
+
+
+def axis_of(vector):
+    """Return the index of the non-zero component of a unit vector"""
+    return [component != 0 for component in vector].index(True)
+
+
+def orient(cube, up, right):
+    """
+    Return a view of the cube indexed as [i, j, depth] from the perspective of the player,
+    where i moves along the right vector and j along the up vector.
+    """
+    right_axis, up_axis = axis_of(right), axis_of(up)
+    depth_axis = 3 - right_axis - up_axis
+    oriented = cube.transpose(right_axis, up_axis, depth_axis)
+    if right[right_axis] < 0:
+        oriented = oriented[::-1, :, :]
+    if up[up_axis] < 0:
+        oriented = oriented[:, ::-1, :]
+    return oriented
+
+
+def orient_image(image, up, right):
+    """Turn an image over the two axes of a plane, in increasing axis order, into an image indexed as [i, j] like orient"""
+    right_axis, up_axis = axis_of(right), axis_of(up)
+    if right_axis > up_axis:
+        image = image.T
+    if right[right_axis] < 0:
+        image = image[::-1, :]
+    if up[up_axis] < 0:
+        image = image[:, ::-1]
+    return np.ascontiguousarray(image, dtype=np.uint8)
+
+
+def project(cube, up, right, depth, lines=None):
+    """
+    Return the 2D cell-kind image of the plane at a given depth.
+
+    Cells in the plane itself hold their kind. Empty cells of the plane show the occupied cell
+    with the highest depth index behind or in front of them, flagged with BACKGROUND.
+
+    Given the cube's LineIndex, only the plane and the background cells it points to are read.
+    """
+    if isinstance(cube, ChunkedCells):
+        return project_chunked(cube, up, right, depth)
+    if lines is not None:
+        return project_lines(cube, lines, up, right, depth)
+    oriented = orient(cube, up, right)
+    occupied = oriented != EMPTY
+    occupied[:, :, depth] = False
+    size = occupied.shape[2]
+    last = size - 1 - np.argmax(occupied[:, :, ::-1], axis=2)
+    rows, columns = np.ogrid[:occupied.shape[0], :occupied.shape[1]]
+    background = np.where(occupied.any(axis=2), oriented[rows, columns, last] | BACKGROUND, EMPTY)
+    foreground = oriented[:, :, depth]
+    return np.where(foreground != EMPTY, foreground, background).astype(np.uint8)
+
+
+def project_lines(cube, lines, up, right, depth):
+    """
+    project from a LineIndex: the background of every line along the depth axis is its highest occupied cell,
+    or its second highest if that one is in the plane
+    """
+    depth_axis = 3 - axis_of(right) - axis_of(up)
+    lines.flush()
+    tops = lines.tops[depth_axis]
+    background_depth = np.where(tops[:, :, 0] != depth, tops[:, :, 0], tops[:, :, 1])
+    lines_cells = np.moveaxis(cube, depth_axis, -1)
+    background = np.take_along_axis(lines_cells, np.maximum(background_depth, 0)[:, :, None], axis=-1)[:, :, 0]
+    background = np.where(background_depth >= 0, background | BACKGROUND, EMPTY)
+    foreground = lines_cells[:, :, depth]
+    return orient_image(np.where(foreground != EMPTY, foreground, background), up, right)
+
+
+def project_chunked(cells, up, right, depth):
+    """
+    project for sparse ChunkedCells. Only the chunks that cross the plane are read for its cells; the background
+    comes from the per-chunk summaries of the highest occupied cell along the depth axis, so it costs a few
+    small array operations per allocated chunk.
+    """
+    right_axis, up_axis = axis_of(right), axis_of(up)
+    depth_axis = 3 - right_axis - up_axis
+    first_axis, second_axis = sorted((right_axis, up_axis))
+    size, padded = cells.size, cells.count * cells.size
+    # Images over the two axes of the plane in increasing order, over whole chunks
+    foreground = np.zeros((padded, padded), dtype=np.uint8)
+    top_depth = np.full((padded, padded), -1, dtype=np.int32)
+    top_kind = np.zeros((padded, padded), dtype=np.uint8)
+    for key, chunk in cells.chunks.items():
+        origin = cells.chunk_origin(key)
+        region = (slice(origin[first_axis], origin[first_axis] + size), slice(origin[second_axis], origin[second_axis] + size))
+        if origin[depth_axis] == depth - (depth & cells.mask):
+            local_depth = depth & cells.mask
+            foreground[region] = np.take(chunk, local_depth, axis=depth_axis)
+            tops, kinds = line_tops(chunk, depth_axis, exclude=local_depth)
+        else:
+            summary_tops, summary_kinds = cells.summary(key)
+            tops, kinds = summary_tops[depth_axis], summary_kinds[depth_axis]
+        tops = np.where(tops >= 0, tops + origin[depth_axis], -1)
+        higher = tops > top_depth[region]
+        top_depth[region][higher] = tops[higher]
+        top_kind[region][higher] = kinds[higher]
+
+    dimensions = cells.shape[0]
+    background = np.where(top_depth >= 0, top_kind | BACKGROUND, EMPTY)
+    return orient_image(np.where(foreground != EMPTY, foreground, background)[:dimensions, :dimensions], up, right)
+
+
+def image_from_objects(plane):
+    """Convert a 2D list of blocks (as returned by GameView.get_slice_objects) to a cell-kind image"""
+    return np.array([[getattr(cell, 'kind', EMPTY) for cell in column] for column in plane], dtype=np.uint8)
@@ -0,0 +1,132 @@
+"""
+Record games to compact binary logs and replay them headlessly, checking that they end in the same state.
+
+A game is fully determined by the seed of its GameModel and the commands applied on every tick, so a log holds:
+	a header: magic, format version, model seed (uint32), grid width (uint16) and flags (uint8: CHUNKED if the
+		grid was stored in chunks, which places food differently, so the game is replayed on the same storage);
+	one record per command: tick (uint32) and command code (uint8), appended as the game goes;
+	an end record: number of ticks (uint32), END code, then the SHA-1 of the final state (see GameModel.state_hash).
+
+`python replay.py log...` replays logs as fast as possible and verifies them, making recorded games regression
+and performance fixtures. `python replay.py --record log [ticks] [width] [seed] [--chunked]` records a game of random commands.
+Python 2 and 3 generate different worlds from the same seed, so logs replay on the Python they were recorded with.
+"""
+import os
+os.environ.setdefault('PYGAME_HIDE_SUPPORT_PROMPT', '1')
+import sys
+import time
+import random
+import struct
+import functools
+from collections import namedtuple
+from model import GameModel, ChunkedGrid
+from headless import RandomController, ScriptedController, run
+from steering import COMMANDS, encode_command, decode_command
+
+MAGIC = b'SNK3'
+VERSION = 2
+HEADER = struct.Struct('<4sBIHB')
+RECORD = struct.Struct('<IB')
+END = 0xff
+HASH_SIZE = 20
+CHUNKED = 1		# Header flag
+
+# ticks and state_hash are None if the log was not finished, e.g. if the game crashed
+Recording = namedtuple('Recording', ['seed', 'dimensions', 'chunked', 'script', 'ticks', 'state_hash'])
+
+
+class Recorder(object):
+	"""Appends the commands that controllers apply to a model to a log, tick by tick"""
+	def __init__(self, path, model, *controllers):
+		self.model = model
+		self.ticks = 0
+		self.log = open(path, 'wb')
+		flags = CHUNKED if isinstance(model.grid, ChunkedGrid) else 0
+		self.log.write(HEADER.pack(MAGIC, VERSION, model.seed, model.grid.dimensions, flags))
+		for controller in controllers:
+			for command in COMMANDS:
+				self.wrap(controller, command)
+
+	def wrap(self, controller, command):
+		"""Replace the controller's change_<command> method with one that also records the command"""
+		original = getattr(controller, 'change_' + command)
+
+		@functools.wraps(original)
+		def recorded(direction):
+			self.log.write(RECORD.pack(self.ticks, encode_command(command, direction)))
+			return original(direction)
+		setattr(controller, 'change_' + command, recorded)
+
+	def tick(self):
+		"""Count a tick of the model; call after every update"""
+		self.ticks += 1
+
+	def close(self):
+		"""Finish the log with the number of ticks and the hash of the final state"""
+		self.log.write(RECORD.pack(self.ticks, END) + self.model.state_hash())
+		self.log.close()
+
+
+def read_log(path):
+	"""Return the Recording stored in a log"""
+	with open(path, 'rb') as log:
+		data = log.read()
+	magic, version, seed, dimensions, flags = HEADER.unpack_from(data)
+	chunked = bool(flags & CHUNKED)
+	if magic != MAGIC or version != VERSION:
+		raise ValueError('%s is not a version %d game log' % (path, VERSION))
+	script = {}
+	for offset in range(HEADER.size, len(data) - RECORD.size + 1, RECORD.size):
+		tick, code = RECORD.unpack_from(data, offset)
+		if code == END:
+			state_hash = data[offset + RECORD.size:offset + RECORD.size + HASH_SIZE]
+			return Recording(seed, dimensions, chunked, script, tick, state_hash)
+		script.setdefault(tick, []).append(decode_command(code))
+	return Recording(seed, dimensions, chunked, script, None, None)
+
+
+def replay(recording):
+	"""Replay a Recording on a new model. Return the model and the number of ticks run"""
+	model = GameModel(recording.dimensions, recording.seed, chunked=recording.chunked)
+	ticks = recording.ticks if recording.ticks is not None else max(recording.script or [-1]) + 1
+	return model, run(model, ScriptedController(model, recording.script), ticks)
+
+
+def record_random_game(path, ticks, dimensions, seed, chunked=False):
+	"""Record a game of random commands of up to a number of ticks. Return the model and the number of ticks run"""
+	model = GameModel(dimensions, seed, chunked=chunked)
+	controller = RandomController(model, random.Random(seed))
+	recorder = Recorder(path, model, controller)
+	for tick in range(ticks):
+		if model.snake.dead:
+			break
+		controller.act(tick)
+		model.update_snake()
+		model.check_collision()
+		recorder.tick()
+	recorder.close()
+	return model, recorder.ticks
+
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['--record']:
+		arguments = [int(argument) for argument in sys.argv[3:] if argument != '--chunked']
+		ticks, dimensions, seed = arguments + [10000, 51, 0][len(arguments):]
+		model, ticks = record_random_game(sys.argv[2], ticks, dimensions, seed, '--chunked' in sys.argv)
+		print('recorded %d ticks to %s, score %d' % (ticks, sys.argv[2], model.score))
+		sys.exit()
+	failures = 0
+	for path in sys.argv[1:]:
+		recording = read_log(path)
+		start = time.time()
+		model, ticks = replay(recording)
+		elapsed = time.time() - start
+		if recording.state_hash is None:
+			status = 'unfinished log, final state not checked'
+		elif ticks == recording.ticks and model.state_hash() == recording.state_hash:
+			status = 'ok'
+		else:
+			status = 'MISMATCH'
+			failures += 1
+		print('%s: %d ticks in %.3f s (%.0f ticks/s), %s' % (path, ticks, elapsed, ticks / max(elapsed, 1e-9), status))
+	sys.exit(1 if failures else 0)
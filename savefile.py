@@ -0,0 +1,119 @@
+"""
+Save the complete state of a game to a flat binary file, and load it back, with numpy.memmap.
+
+A save file is a fixed header followed by arrays at offsets aligned to ALIGNMENT bytes:
+	header: the HEADER record, with the sizes of the arrays and the scalar state of the model;
+	random_state: the 625 words of the model's Mersenne Twister;
+	cells, free, free_slot: the arrays of the GameGrid;
+	body: the ring buffer of the Snake;
+	foods: the positions of the foods.
+Loading maps the file copy-on-write, so the grid's arrays are read from disk as the game touches them,
+and changes made to them never go back to the file.
+"""
+import random
+import numpy as np
+from model import GameModel, GameGrid, ChunkedGrid, BlockView, Snake, Plane, Food
+
+MAGIC = b'SNKS'
+VERSION = 1
+ALIGNMENT = 64
+DIRECTIONS = [None, 'up', 'left', 'down', 'right']
+HEADER = np.dtype([
+	('magic', 'S4'), ('version', '<u4'), ('dimensions', '<u4'), ('capacity', '<u4'), ('food_count', '<u4'),
+	('seed', '<u8'), ('free_count', '<u8'), ('start', '<u4'), ('length', '<u4'),
+	('direction', 'u1'), ('dead', 'u1'), ('snake_dead', 'u1'), ('contact', 'u1'), ('orientation', '<u4'),
+	('growth_counter', '<i4'), ('growth_rate', '<i4'), ('depth', '<i4'),
+	('score', '<i8'), ('score2', '<i8'), ('random_version', '<i4'), ('gauss_next', '<f8'), ('has_gauss_next', 'u1'),
+])
+
+
+def layout(header):
+	"""Return [(name, dtype, shape, offset)] for the arrays of a save file with a given header, and the size of the file"""
+	dimensions = int(header['dimensions'])
+	arrays = [
+		('random_state', '<u4', (625,)),
+		('cells', 'u1', (dimensions,) * 3),
+		('free', '<i4', (dimensions ** 3,)),
+		('free_slot', '<i4', (dimensions ** 3,)),
+		('body', '<i4', (int(header['capacity']), 3)),
+		('foods', '<i4', (int(header['food_count']), 3)),
+	]
+	offset = HEADER.itemsize
+	placed = []
+	for name, dtype, shape in arrays:
+		offset = -(-offset // ALIGNMENT) * ALIGNMENT
+		placed.append((name, dtype, shape, offset))
+		offset += int(np.prod(shape)) * np.dtype(dtype).itemsize
+	return placed, offset
+
+
+def save(model, path):
+	"""Write the state of a model to a save file"""
+	if isinstance(model.grid, ChunkedGrid):
+		raise ValueError('save files hold dense grids only')
+	snake = model.snake
+	random_version, random_state, gauss_next = model.random.getstate()
+	header = np.zeros((), dtype=HEADER)
+	header['magic'], header['version'], header['seed'] = MAGIC, VERSION, model.seed
+	header['dimensions'], header['capacity'], header['food_count'] = model.grid.dimensions, len(snake.body), len(model.foods)
+	header['free_count'], header['start'], header['length'] = model.grid.free_count, snake.start, snake.length
+	header['direction'], header['dead'], header['snake_dead'] = DIRECTIONS.index(snake.direction), model.dead, snake.dead
+	header['contact'], header['orientation'], header['depth'] = model.contact, model.plane.orientation, model.plane.depth
+	header['growth_counter'], header['growth_rate'] = snake.growth_counter, snake.growth_rate
+	header['score'], header['score2'], header['random_version'] = model.score, model.score2, random_version
+	header['has_gauss_next'], header['gauss_next'] = gauss_next is not None, gauss_next or 0.0
+	arrays, size = layout(header)
+	data = np.memmap(path, dtype=np.uint8, mode='w+', shape=(size,))
+	data[:HEADER.itemsize] = np.frombuffer(header.tobytes(), dtype=np.uint8)
+	values = {'random_state': random_state, 'cells': model.grid.cells, 'free': model.grid.free,
+		'free_slot': model.grid.free_slot, 'body': snake.body, 'foods': sorted(model.foods) or np.zeros((0, 3))}
+	for name, dtype, shape, offset in arrays:
+		np.ndarray(shape, dtype, buffer=data, offset=offset)[...] = values[name]
+	data.flush()
+	del data
+
+
+def load(path):
+	"""Return a GameModel with the state stored in a save file"""
+	data = np.memmap(path, dtype=np.uint8, mode='c')
+	header = np.frombuffer(data[:HEADER.itemsize].tobytes(), dtype=HEADER)[0]
+	if header['magic'] != MAGIC or header['version'] != VERSION:
+		raise ValueError('%s is not a version %d save file' % (path, VERSION))
+	arrays, size = layout(header)
+	values = dict((name, np.ndarray(shape, dtype, buffer=data, offset=offset)) for name, dtype, shape, offset in arrays)
+
+	# Build the objects of the model around the arrays of the file instead of generating a new world
+	model = GameModel.__new__(GameModel)
+	model.seed = int(header['seed'])
+	model.random = random.Random()
+	gauss_next = float(header['gauss_next']) if header['has_gauss_next'] else None
+	model.random.setstate((int(header['random_version']), tuple(int(word) for word in values['random_state']), gauss_next))
+
+	grid = model.grid = GameGrid.__new__(GameGrid)
+	grid.dimensions = int(header['dimensions'])
+	grid.cells, grid.free, grid.free_slot = values['cells'], values['free'], values['free_slot']
+	grid.free_count = int(header['free_count'])
+	grid.grid = BlockView(grid)
+	grid.lines = None
+	grid.journal = None
+	grid.journal_start = 0
+	grid.start_kinds = None
+	grid.dirty = None
+
+	snake = model.snake = Snake((0, 0, 0), DIRECTIONS[header['direction']], int(header['growth_rate']))
+	snake.body = np.array(values['body'], dtype=np.int32)
+	snake.start, snake.length = int(header['start']), int(header['length'])
+	snake.growth_counter, snake.dead = int(header['growth_counter']), bool(header['snake_dead'])
+	positions = [tuple(position) for position in snake.positions().tolist()]
+	snake.head_position = positions[0]
+	snake.occupied = {}
+	for position in positions:
+		snake.occupied[position] = snake.occupied.get(position, 0) + 1
+
+	model.foods = dict((tuple(position), Food(*position)) for position in values['foods'].tolist())
+	model.plane = Plane()
+	model.plane.orientation, model.plane.depth = int(header['orientation']), int(header['depth'])
+	model.dead, model.contact = bool(header['dead']), int(header['contact'])
+	model.score, model.score2 = int(header['score']), int(header['score2'])
+	model.start = None
+	return model
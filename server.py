@@ -0,0 +1,391 @@
+"""
+Authoritative multiplayer server: several snakes share the cube of one model, steered by clients over TCP.
+
+The server owns a SharedModel and advances it at a fixed tick with asyncio. Clients send one-byte commands and,
+after a WELCOME message with every non-empty cell, receive one TICK message per tick with only the cells that
+changed during it, read from the grid's journal. A cell change is one 32-bit word, cell id * 4 + kind, so a tick
+costs a few bytes per moving snake rather than a slice of the world per client.
+
+Messages from the server:
+	WELCOME: magic, version, player id, grid width, tick, cell count; then the cells as words;
+	TICK: tick, depth and orientation of the player's plane, whether its snake is dead, its score, change count;
+		then the changes as words. The changes are encoded once per tick and sent to every client.
+Messages from a client are single command bytes: the codes of steering.encode_command, which replay logs store too,
+or RESPAWN to get a new snake after dying.
+
+`python server.py [port] [width]` serves a world on localhost. `python server.py load [snakes...]` runs a load test
+with bots on localhost and reports ticks per second and bandwidth. The server needs Python 3.7 or later.
+"""
+import sys
+import time
+import random
+import struct
+import asyncio
+from collections import deque
+import numpy as np
+from model import GameModel, GameGrid, Snake, Plane, Collision, EMPTY, SNAKE, WALL
+from steering import DIRECTIONS, encode_command, decode_command
+
+MAGIC = b'SNKM'
+VERSION = 1
+WELCOME = struct.Struct('<4sBHHII')
+TICK = struct.Struct('<IHBBiI')
+RESPAWN = 0xfe
+
+
+class Player(object):
+	"""
+	A snake of a SharedModel, with its own plane, score and queue of commands. snake is None until the player
+	first spawns, and spawning is True while it waits for the next tick to get a new snake
+	"""
+	def __init__(self, player_id, snake, plane):
+		self.id = player_id
+		self.snake = snake
+		self.plane = plane
+		self.contact = EMPTY
+		self.score = 0
+		self.score2 = 0
+		self.commands = deque()
+		self.spawning = False
+
+	def playing(self):
+		return self.snake is not None and not self.snake.dead
+
+
+def current_player_attribute(name):
+	"""Property of a SharedModel standing for an attribute of its current player, so GameModel's methods move that player"""
+	return property(lambda self: getattr(self.player, name), lambda self, value: setattr(self.player, name, value))
+
+
+class SharedModel(GameModel):
+	"""
+	GameModel of a world shared by several players.
+
+	Data:
+		players: dict mapping player ids to Players.
+		player: the Player that GameModel's methods act on; snake, plane, contact and the scores are that player's.
+
+	The grid's journal collects the cells changed since take_changes was last called, so shared models can't be
+	snapshotted. New players and respawns only get their snake in update, so that every change to the world
+	happens in a tick and goes out with it.
+	"""
+	snake, plane, contact, score, score2 = [current_player_attribute(name) for name in
+		('snake', 'plane', 'contact', 'score', 'score2')]
+
+	def __init__(self, dimensions=50, seed=None, food_count=16, queue_length=4):
+		self.seed = random.randrange(2 ** 32) if seed is None else seed
+		self.random = random.Random(self.seed)
+		self.grid = GameGrid(dimensions)
+		self.players = {}
+		self.player = None
+		self.next_id = 0
+		self.queue_length = queue_length
+		self.foods = {}
+		self.dead = False
+		self.start = None
+		self.make_blob_walls(6, 9)
+		self.make_food(food_count)
+		self.grid.journal = []
+
+	def add_player(self):
+		"""Add a player, which gets its snake on the next tick. Return the Player"""
+		player = Player(self.next_id, None, Plane())
+		player.spawning = True
+		self.next_id += 1
+		self.players[player.id] = player
+		return player
+
+	def remove_player(self, player_id):
+		"""Remove a player and its snake from the world"""
+		player = self.players.pop(player_id)
+		if player.playing():
+			self.clear_snake(player.snake)
+
+	def spawn(self, player):
+		"""
+		Give a player a new snake, standing still in a random empty cell, and a plane through it.
+		Return False, leaving the player waiting, if there is no room left in the world
+		"""
+		position = self.grid.random_free_cell(self.random)
+		if position is None:
+			return False
+		player.snake = Snake(position)
+		player.plane = Plane(depth=position[2])
+		player.contact = EMPTY
+		player.score = player.score2 = 0
+		player.spawning = False
+		self.grid.set_kind(position, SNAKE)
+		return True
+
+	def command(self, player_id, code):
+		"""
+		Queue the command of a code sent by a client. RESPAWN drops the commands queued so far and, if the player's
+		snake is dead, gives it a new one on the next tick
+		"""
+		player = self.players[player_id]
+		if code == RESPAWN:
+			if player.snake is not None and player.snake.dead:
+				player.commands.clear()
+				player.spawning = True
+		elif decode_command(code) is not None and len(player.commands) < self.queue_length:
+			player.commands.append(decode_command(code))
+
+	def update(self):
+		"""
+		Advance the world by one tick: spawn the snakes of the players waiting for one, apply one queued command
+		per player and move every live snake, then resolve the collisions once all of them moved, so that the
+		outcome doesn't depend on the order of the players. A head may enter the cell a tail leaves in the same
+		tick. Snakes that die are removed from the world. Return the Collisions of the tick.
+		"""
+		for player in self.players.values():
+			if player.spawning:
+				self.spawn(player)
+		playing = [player for player in self.players.values() if player.playing()]
+		for player in playing:
+			self.player = player
+			if player.commands:
+				command, direction = player.commands.popleft()
+				if command == 'direction':
+					self.snake.change_direction(direction)
+				else:
+					self.change_orientation(direction)
+			self.update_snake()
+		# A snake moved later may have emptied the cell of its tail after another head moved into it
+		for player in playing:
+			if self.grid.kind_at(player.snake.head_position) != SNAKE:
+				self.grid.set_kind(player.snake.head_position, SNAKE)
+
+		collisions, deaths = [], []
+		for player in playing:
+			self.player = player
+			collision = self.check_collision()
+			head = player.snake.head_position
+			if not player.snake.dead and sum(other.snake.occupied.get(head, 0) for other in playing) > 1:
+				player.snake.die()
+				collision = Collision(SNAKE, head)
+			if collision is not None:
+				collisions.append(collision)
+				if player.snake.dead:
+					deaths.append((player, collision))
+		self.player = None
+		for player, collision in deaths:
+			self.clear_snake(player.snake)
+			if collision.kind == WALL:
+				self.grid.set_kind(collision.position, WALL)
+		return collisions
+
+	def clear_snake(self, snake):
+		"""Empty the cells of a snake that no live snake occupies"""
+		for position in snake.occupied:
+			if not any(other.snake.occupies(position) for other in self.players.values()
+					if other.snake is not snake and other.playing()):
+				self.grid.set_kind(position, EMPTY)
+
+	def take_changes(self):
+		"""Return the cells whose kind changed since the last call, as an array of words: cell id * 4 + kind"""
+		journal, self.grid.journal = self.grid.journal, []
+		old_kinds = {}
+		for xyz, old_kind, slot in journal:
+			old_kinds.setdefault(xyz, old_kind)
+		cells = self.grid.cells
+		changed = [self.grid.cell_id(xyz) * 4 + int(cells[xyz]) for xyz, old_kind in old_kinds.items() if cells[xyz] != old_kind]
+		return np.array(sorted(changed), dtype='<u4')
+
+	def cell_words(self):
+		"""Return every non-empty cell of the world as an array of words: cell id * 4 + kind"""
+		cell_ids = np.flatnonzero(self.grid.cells)
+		return (cell_ids * 4 + self.grid.cells.ravel()[cell_ids]).astype('<u4')
+
+
+def apply_words(cells, words):
+	"""Write cells encoded as words (cell id * 4 + kind) to a cube of cells"""
+	cells.ravel()[words >> 2] = words & 3
+
+
+class GameServer(object):
+	"""
+	Serves a SharedModel: every connection gets a player, whose commands are applied as the model ticks.
+
+	Clients that fall more than max_buffer bytes behind are disconnected, since they could never catch up
+	with the changes. ticks_per_second of 0 runs the ticks back to back, to measure how fast the server goes.
+	"""
+	def __init__(self, model, ticks_per_second=12, max_buffer=1 << 20):
+		self.model = model
+		self.interval = 1.0 / ticks_per_second if ticks_per_second else 0.0
+		self.max_buffer = max_buffer
+		self.clients = {}		# Player id -> StreamWriter
+		self.ticks = 0
+		self.bytes_sent = 0
+
+	async def handle_client(self, reader, writer):
+		"""Add a player for a new connection and queue its commands until it disconnects"""
+		player = self.model.add_player()
+		words = self.model.cell_words()
+		self.send(writer, [WELCOME.pack(MAGIC, VERSION, player.id, self.model.grid.dimensions, self.ticks, len(words)), words.tobytes()])
+		self.clients[player.id] = writer
+		try:
+			while True:
+				data = await reader.read(64)
+				if not data:
+					break
+				for code in bytearray(data):
+					self.model.command(player.id, code)
+		except ConnectionError:
+			pass
+		finally:
+			del self.clients[player.id]
+			self.model.remove_player(player.id)
+			writer.close()
+
+	def send(self, writer, chunks):
+		writer.writelines(chunks)
+		self.bytes_sent += sum(len(chunk) for chunk in chunks)
+
+	def tick(self):
+		"""Advance the model and send every client the changes, with the state of its own player"""
+		self.model.update()
+		self.ticks += 1
+		changes = self.model.take_changes().tobytes()
+		count = len(changes) // 4
+		for player_id, writer in list(self.clients.items()):
+			if writer.is_closing():
+				continue
+			if writer.transport.get_write_buffer_size() > self.max_buffer:
+				writer.close()
+				continue
+			player = self.model.players[player_id]
+			header = TICK.pack(self.ticks, player.plane.depth, player.plane.orientation, not player.playing(), player.score, count)
+			self.send(writer, [header, changes])
+
+	async def run(self, ticks=None, seconds=None):
+		"""Tick at a fixed rate, forever or for a number of ticks or seconds, dropping the ticks it falls behind on"""
+		loop = asyncio.get_running_loop()
+		end = loop.time() + seconds if seconds is not None else None
+		next_tick = loop.time()
+		count = 0
+		while (ticks is None or count < ticks) and (end is None or loop.time() < end):
+			self.tick()
+			count += 1
+			next_tick = max(next_tick + self.interval, loop.time() - self.interval)
+			await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+
+class Client(object):
+	"""
+	Headless client of a GameServer, keeping a copy of the world's cells up to date from its messages.
+
+	Data:
+		cells: uint8 array of the kinds of the cells, like GameGrid.cells.
+		tick, depth, orientation, dead, score: state of the player as of the last TICK message.
+	"""
+	def __init__(self, reader, writer):
+		self.reader = reader
+		self.writer = writer
+		self.bytes_received = 0
+
+	@classmethod
+	async def connect(cls, host, port):
+		"""Connect to a server and read its WELCOME message. Return the Client"""
+		reader, writer = await asyncio.open_connection(host, port)
+		client = cls(reader, writer)
+		magic, version, client.player_id, dimensions, client.tick, count = WELCOME.unpack(await client.read(WELCOME.size))
+		if magic != MAGIC or version != VERSION:
+			raise ValueError('not a version %d game server' % VERSION)
+		client.cells = np.zeros((dimensions,) * 3, dtype=np.uint8)
+		apply_words(client.cells, np.frombuffer(await client.read(count * 4), dtype='<u4'))
+		client.depth, client.orientation, client.dead, client.score = 0, 0, False, 0
+		return client
+
+	async def read(self, size):
+		data = await self.reader.readexactly(size)
+		self.bytes_received += size
+		return data
+
+	async def receive(self):
+		"""Read the message of the next tick and apply its changes"""
+		self.tick, self.depth, self.orientation, dead, self.score, count = TICK.unpack(await self.read(TICK.size))
+		self.dead = bool(dead)
+		apply_words(self.cells, np.frombuffer(await self.read(count * 4), dtype='<u4'))
+
+	def send(self, command, direction):
+		"""Send a command: 'direction' to steer the snake or 'orientation' to rotate the plane"""
+		self.writer.write(bytearray([encode_command(command, direction)]))
+
+	def respawn(self):
+		self.writer.write(bytearray([RESPAWN]))
+
+	def close(self):
+		self.writer.close()
+
+
+async def play_randomly(client, rng, turn_probability=0.2, rotate_probability=0.02):
+	"""Steer a client's snake at random until the connection closes, respawning whenever it dies"""
+	client.send('direction', rng.choice(DIRECTIONS))
+	try:
+		while True:
+			await client.receive()
+			if client.dead:
+				client.respawn()
+				client.send('direction', rng.choice(DIRECTIONS))
+			elif rng.random() < turn_probability:
+				client.send('direction', rng.choice(DIRECTIONS))
+			elif rng.random() < rotate_probability:
+				client.send('orientation', rng.choice(DIRECTIONS))
+	except (asyncio.IncompleteReadError, ConnectionError):
+		pass
+
+
+async def load_test(snakes, seconds=5.0, dimensions=51, seed=0):
+	"""
+	Serve a world as fast as possible to a number of random bots on localhost for some seconds, then check that
+	every client's copy of the cells matches the server's. Return (ticks, seconds, bytes sent, whether all matched)
+	"""
+	model = SharedModel(dimensions, seed, food_count=max(16, snakes))
+	server = GameServer(model, ticks_per_second=0)
+	listener = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+	port = listener.sockets[0].getsockname()[1]
+	clients = [await Client.connect('127.0.0.1', port) for snake in range(snakes)]
+	while len(server.clients) < snakes:
+		await asyncio.sleep(0.01)
+	rng = random.Random(seed)
+	bots = [asyncio.ensure_future(play_randomly(client, random.Random(rng.random()))) for client in clients]
+	start = time.time()
+	await server.run(seconds=seconds)
+	elapsed = time.time() - start
+	while not all(client.tick == server.ticks or bot.done() for client, bot in zip(clients, bots)):
+		await asyncio.sleep(0.01)
+	matched = all(np.array_equal(client.cells, model.grid.cells) for client in clients)
+	for bot, client in zip(bots, clients):
+		bot.cancel()
+		client.close()
+	while server.clients:
+		await asyncio.sleep(0.01)
+	listener.close()
+	await listener.wait_closed()
+	return server.ticks, elapsed, server.bytes_sent, matched
+
+
+async def serve(port, dimensions):
+	model = SharedModel(dimensions)
+	server = GameServer(model)
+	listener = await asyncio.start_server(server.handle_client, '127.0.0.1', port)
+	print('serving a %d wide world on port %d' % (dimensions, port))
+	async with listener:
+		await server.run()
+
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['load']:
+		counts = [int(argument) for argument in sys.argv[2:]] or [2, 16, 64]
+		failures = 0
+		for snakes in counts:
+			ticks, elapsed, sent, matched = asyncio.run(load_test(snakes))
+			failures += not matched
+			per_client = sent / float(ticks * snakes)
+			print('%2d snakes: %6.0f ticks/s, %5.0f B/tick per client (%.1f kB/s at 12 ticks/s), %.2f MB/s sent in all, %s' % (
+				snakes, ticks / elapsed, per_client, per_client * 12 / 1000, sent / elapsed / 1e6,
+				'clients in sync' if matched else 'CLIENTS OUT OF SYNC'))
+		sys.exit(1 if failures else 0)
+	arguments = [int(argument) for argument in sys.argv[1:]]
+	port, dimensions = arguments + [7777, 51][len(arguments):]
+	asyncio.run(serve(port, dimensions))
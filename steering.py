@@ -0,0 +1,96 @@
+"""
+Steering the snake without pygame: the commands, their one-byte codes and the Controller that applies them
+with the scoring rules of the game, shared by the keyboard controller, the headless and AI controllers,
+replay logs and the multiplayer server.
+"""
+from collections import deque
+
+DIRECTIONS = ['up', 'left', 'down', 'right']
+COMMANDS = ['direction', 'orientation']
+
+
+def encode_command(command, direction):
+    """Return the code of a command, as stored in replay logs and sent to the server: COMMANDS index * 4 + DIRECTIONS index"""
+    return COMMANDS.index(command) * 4 + DIRECTIONS.index(direction)
+
+
+def decode_command(code):
+    """Return the (command, direction) of a code, or None if it isn't the code of a command"""
+    if code // 4 >= len(COMMANDS):
+        return None
+    return COMMANDS[code // 4], DIRECTIONS[code % 4]
+
+
+class Controller(object):
+    """
+    Applies commands to a model: 'direction' to steer the snake and 'orientation' to rotate the plane, each
+    costing a point of score2 once the snake moves. Subclasses decide which commands to give, from key presses
+    (controller.GameController), a script or random choices (headless) or a path planner (autopilot).
+
+    Commands can be queued, and apply_command applies one of them per tick, so that several commands given
+    within a tick all take effect, in order, on the following ticks.
+
+    Undo goes back to the oldest of the snapshots that checkpoint takes as the game goes. The model is told to
+    forget the states before it, so that the grid's journal only holds the changes of the last few seconds.
+    """
+    def __init__(self, model, queue_length=4, checkpoint_interval=12, checkpoint_count=3):
+        self.model = model
+        self.commands = deque()
+        self.queue_length = queue_length #Commands beyond this many waiting ones are ignored
+        self.checkpoints = deque() #Snapshots of the model to undo to, oldest first
+        self.checkpoint_interval = checkpoint_interval #Ticks between checkpoints
+        self.checkpoint_count = checkpoint_count
+        self.ticks = 0 #Ticks since the last checkpoint started counting
+
+    def queue_command(self, command, direction):
+        """Queue a command for a following tick. Return False if the queue was full and it was ignored"""
+        if len(self.commands) >= self.queue_length:
+            return False
+        self.commands.append((command, direction))
+        return True
+
+    def apply_command(self):
+        """Apply the oldest queued command, if any; called once per tick before the model moves"""
+        if self.commands:
+            command, direction = self.commands.popleft()
+            getattr(self, 'change_' + command)(direction)
+
+    def checkpoint(self):
+        """Count a tick and take a snapshot of the model every checkpoint_interval ticks; called before the model moves"""
+        if self.ticks % self.checkpoint_interval == 0:
+            self.checkpoints.append(self.model.snapshot())
+            if len(self.checkpoints) > self.checkpoint_count:
+                self.checkpoints.popleft()
+                self.model.forget(self.checkpoints[0])
+        self.ticks += 1
+
+    def undo(self):
+        """Go back to the oldest checkpoint, a few seconds before the snake died"""
+        if not self.checkpoints:
+            return
+        oldest = self.checkpoints[0]
+        self.model.restore(oldest)
+        self.checkpoints = deque([oldest]) #The checkpoints taken after it can't be restored anymore
+        self.commands.clear()
+        self.ticks = 1
+
+    def restart(self, same_map=False):
+        """Restart the game, in a new world or on the same map, forgetting the commands and checkpoints of the last one"""
+        self.model.restart(same_map)
+        self.commands.clear()
+        self.checkpoints.clear()
+        self.ticks = 0
+
+    def change_direction(self, direction):
+        """Change direction of the snake, decrease score by 1"""
+        old_direction = self.model.snake.direction
+        self.model.snake.change_direction(direction)
+        if old_direction is not None and old_direction != self.model.snake.direction:
+            self.model.score2 -= 1
+
+    def change_orientation(self, direction):
+        """Change orientation of the model, decrease score by 1"""
+        old_direction = self.model.snake.direction
+        self.model.change_orientation(direction)
+        if old_direction is not None:
+            self.model.score2 -= 1
@@ -0,0 +1,76 @@
+"""
+Procedural generation of walls with array operations.
+
+Every generator writes a kind into the empty (zero) cells of a cube in place and returns the positions
+it filled, as an array of shape (count, 3). All of the randomness comes from the numpy RandomState
+it is given, so the same seed always produces the same walls.
+"""
+import numpy as np
+
+DIRECTIONS = np.array([(1,0,0),(0,1,0),(0,0,1),(-1,0,0),(0,-1,0),(0,0,-1)])
+
+
+def dilate(mask):
+	"""Binary dilation by the 6 face neighbours over the last three axes of a mask (cells outside of it are never set)"""
+	dilated = mask.copy()
+	dilated[..., 1:, :, :] |= mask[..., :-1, :, :]
+	dilated[..., :-1, :, :] |= mask[..., 1:, :, :]
+	dilated[..., 1:, :] |= mask[..., :-1, :]
+	dilated[..., :-1, :] |= mask[..., 1:, :]
+	dilated[..., 1:] |= mask[..., :-1]
+	dilated[..., :-1] |= mask[..., 1:]
+	return dilated
+
+
+def make_blobs(cells, num_blobs, size_blobs, proba, rng, kind):
+	"""
+	Grow blobs of a given kind around random empty cells.
+
+	Each blob grows for size_blobs steps. At every step, each empty neighbour of the cells added on
+	the previous step joins the blob with probability proba. All of the blobs grow at once, each in its
+	own window of radius size_blobs around its origin (all it can reach), stacked in one array, so the
+	cost doesn't depend on the size of the cube.
+	"""
+	dimensions = cells.shape[0]
+	origins = rng.randint(0, dimensions, size=(num_blobs, 3))
+	origins = origins[cells[tuple(origins.T)] == 0]
+	# Coordinates covered by every window along each axis, shape (blobs, 3, window width)
+	coordinates = origins[:, :, None] + np.arange(-size_blobs, size_blobs + 1)
+	inside = (coordinates >= 0) & (coordinates < dimensions)
+	coordinates = np.clip(coordinates, 0, dimensions - 1)
+	x, y, z = coordinates[:, 0, :, None, None], coordinates[:, 1, None, :, None], coordinates[:, 2, None, None, :]
+	allowed = (cells[x, y, z] == 0) & inside[:, 0, :, None, None] & inside[:, 1, None, :, None] & inside[:, 2, None, None, :]
+
+	blobs = np.zeros(allowed.shape, dtype=bool)
+	frontier = np.zeros(allowed.shape, dtype=bool)
+	frontier[:, size_blobs, size_blobs, size_blobs] = True
+	for step in range(size_blobs):
+		frontier = dilate(frontier) & allowed & ~blobs
+		candidates = np.flatnonzero(frontier)
+		frontier.ravel()[candidates] = rng.random_sample(len(candidates)) < proba
+		blobs |= frontier
+
+	blob, i, j, k = np.nonzero(blobs)
+	positions = np.column_stack((x[blob, i, 0, 0], y[blob, 0, j, 0], z[blob, 0, 0, k]))
+	return fill(cells, positions, kind)
+
+
+def make_random_walks(cells, num_walks, walk_length, rng, kind):
+	"""
+	Fill the empty cells visited by random walks through the cube with a given kind, wrapping around its edges.
+	All of the walks are taken at once as a cumulative sum of random unit steps.
+	"""
+	dimensions = cells.shape[0]
+	starts = rng.randint(0, dimensions, size=(num_walks, 1, 3))
+	steps = DIRECTIONS[rng.randint(0, len(DIRECTIONS), size=(num_walks, walk_length))]
+	positions = ((starts + np.cumsum(steps, axis=1)) % dimensions).reshape(-1, 3)
+	return fill(cells, positions, kind)
+
+
+def fill(cells, positions, kind):
+	"""Write a kind into the cells at the given positions that are empty, and return the distinct positions filled"""
+	positions = np.unravel_index(np.unique(np.ravel_multi_index(np.transpose(positions), cells.shape)), cells.shape)
+	empty = cells[positions] == 0
+	positions = tuple(axis[empty] for axis in positions)
+	cells[positions] = kind
+	return np.column_stack(positions)
@@ -1,19 +1,52 @@
+import random
 import pygame
 import numpy as np
-from model import BackgroundObject
+from model import GameModel, BackgroundObject, SnakeBodyPart, Food, Wall, BACKGROUND, ORIENTATION_INDEX, LINE_INDEX_WIDTH
 from helpers import vector_add, vector_multiply
+import projection
+from pipeline import SlicePipeline
 
 class GameView(object):
     """
     Creates the player's view of the game state. Slices the 3D grid appropriately depending on the state of the model.
     """
-    def __init__(self, model, screen, square_size=10):
+    def __init__(self, model, screen, square_size=10, incremental=True):
         self.model = model
         self.screen = screen
         self.square_size = square_size #Width/height in pixels of individual squares
+        self.palette = self.make_palette()
+        self.incremental = incremental #Only redraw the cells that changed since the previous frame
+        self.drawn_slice = None #Slice, plane state and score shown on screen by the previous frame
+        self.drawn_state = None
+        self.drawn_score = None
+        self.overlay = None #Optional function returning lines of text to print below the field, e.g. profiling figures
+        self.fonts = {} #Fonts loaded so far, by size
+        self.score_text = None #Rendered score, and the score it shows
+        self.score_text_value = None
+        self.death_texts = {} #Rendered death screen texts and their positions, by message and font size
+
+    def make_palette(self):
+        """Return the colors to draw for every cell kind, indexed by [dead][kind]"""
+        black = pygame.Color('black')
+        alive = [black] * (2 * BACKGROUND)
+        dead = [black] * (2 * BACKGROUND)
+        for block in (SnakeBodyPart, Food, Wall):
+            alive[block.kind] = block.color
+            alive[block.kind | BACKGROUND] = block.background_color
+            dead[block.kind] = block.dead_color     #Background blocks have no dead color and are drawn black
+        return (alive, dead)
 
     def get_slice(self):
-        """Return a 2-dimensional array for the plane that the snake is currently moving in"""
+        """Return a 2D array of cell kinds for the plane that the snake is currently moving in"""
+        plane = self.model.plane
+        grid = self.model.grid
+        return projection.project(grid.kinds(), plane.up, plane.right, plane.depth, grid.line_index())
+
+    def get_slice_objects(self):
+        """
+        Reference implementation of get_slice, returning a 2D list of blocks.
+        Slow, but kept to check the projection engine against.
+        """
         def map_origin(depth):
             """Return the location of the bottom-left corner of the plane, adjusted for orientation"""
             map_dict = {-1: len(cube) - 1, 1: 0, 0: depth}
@@ -31,7 +64,6 @@ class GameView(object):
 
         background_slices = [depth for depth in range(len(cube)) if depth != slice_depth] #All slice indices except the foreground
         for depth in background_slices:
-            print 'slice' + str(depth)
             origin = map_origin(depth)      #Starting point (lower-right corner) for a given slice
             for i in range(len(cube)):
                 for j in range(len(cube)):
@@ -51,19 +83,43 @@ class GameView(object):
         return grid
 
     def draw(self):
-        """Print the current grid slice to the screen"""
+        """
+        Print the current grid slice to the screen.
+
+        In incremental mode, only the cells that differ from the previous frame are redrawn, and only their
+        rectangles are updated on the display. The whole screen is redrawn when the plane rotates or the snake
+        dies or comes back to life.
+        """
         plane = self.get_slice()
+        dead = self.model.snake.dead
+        state = (self.model.plane.up, self.model.plane.right, self.model.plane.depth, dead)
+        colors = self.palette[dead]
+
+        if not self.incremental or state != self.drawn_state or plane.shape != self.drawn_slice.shape:
+            self.draw_full(plane, colors)
+            self.print_overlay()
+            pygame.display.update()
+        else:
+            dirty = [self.draw_cell(i, j, colors[plane[i, j]]) for i, j in np.argwhere(plane != self.drawn_slice)]
+            if self.model.score2 != self.drawn_score:
+                dirty.append(self.print_score())
+            overlay_area = self.print_overlay()
+            if overlay_area:
+                dirty.append(overlay_area)
+            pygame.display.update(dirty)
+
+        self.drawn_slice = plane
+        self.drawn_state = state
+        self.drawn_score = self.model.score2
+
+    def draw_full(self, plane, colors):
+        """Draw the whole screen from scratch"""
         self.screen.fill(pygame.Color('black'))
 
-        # Place the appropriate rectangle for every element of the grid (None, SnakeBodyPart, Wall or Food) 
+        # Place the appropriate rectangle for every cell of the slice (empty, snake, wall, food or background)
         for i in range(len(plane)):
             for j in range(len(plane[i])):
-                get_rect = pygame.Rect(*self.coord_to_pixels((i, j)))
-                try: #Try to get color attribute
-                    color = plane[i][j].color if not self.model.snake.dead else plane[i][j].dead_color
-                except: #If the block is empty
-                    color = pygame.Color('black')
-                pygame.draw.rect(self.screen, color, get_rect)
+                self.draw_cell(i, j, colors[plane[i][j]])
 
         self.print_score()
 
@@ -71,7 +127,11 @@ class GameView(object):
         if self.model.snake.dead:
             self.print_death_text('Wasted', 64)
 
-        pygame.display.update()
+    def draw_cell(self, i, j, color):
+        """Draw a single cell of the slice and return its rectangle"""
+        get_rect = pygame.Rect(*self.coord_to_pixels((i, j)))
+        pygame.draw.rect(self.screen, color, get_rect)
+        return get_rect
 
     def coord_to_pixels(self, coords):
         """Take a coordinate pair on the grid and convert to pygame rectangle parameters"""
@@ -80,48 +140,174 @@ class GameView(object):
         width, height = (self.square_size, self.square_size)
         return (left, top, width, height)
 
+    def font(self, size):
+        """Return the default font at a given size, loading it the first time it is asked for"""
+        if size not in self.fonts:
+            self.fonts[size] = pygame.font.Font(None, size)
+        return self.fonts[size]
+
     def print_death_text(self, death_message, font_size):
+        """Print the death message and the options over the field, rendering them the first time only"""
+        if (death_message, font_size) not in self.death_texts:
+            self.death_texts[death_message, font_size] = self.render_death_text(death_message, font_size)
+        for text, textpos in self.death_texts[death_message, font_size]:
+            self.screen.blit(text, textpos)
 
-        dead_font = pygame.font.Font(None, font_size)
-        options_font = pygame.font.Font(None, font_size/2)
+    def render_death_text(self, death_message, font_size):
+        """Return the rendered texts of the death screen and their positions"""
+        dead_font = self.font(font_size)
+        options_font = self.font(font_size//2)
         options_color = (181, 180, 103)
-
-        background = pygame.Surface(self.screen.get_size())
-        background = background.convert()
+        center = self.screen.get_width()//2  # center of the square field, both horizontally and vertically
 
         # Wasted
         text = dead_font.render(death_message, 1, (200, 0, 0, 1))
-        textpos = text.get_rect()
-        textpos.centerx = background.get_rect().centerx
-        textpos.centery = background.get_rect().centerx  # centerx such that the text is at the center of the square field
-        self.screen.blit(text, textpos)
-
-        # Play Again
-        replay = options_font.render("R: Play Again", 1, options_color)
-        replay_pos = replay.get_rect()
-        replay_pos.centerx = background.get_rect().centerx
-        replay_pos.centery = background.get_rect().centerx + font_size*3/4  # centerx such that the text is at the center of the square field
-        self.screen.blit(replay, replay_pos)
-
-        # Play Again
-        quit = options_font.render("Q: Quit", 1, options_color)
-        quit_pos = quit.get_rect()
-                                                         
-        quit_pos.centerx = background.get_rect().centerx
-        quit_pos.centery = background.get_rect().centerx + font_size*3/4 + font_size/2  # centerx such that the text is at the center of the square field
-        self.screen.blit(quit, quit_pos)
-
-    def print_score(self):
-        score_str = 'Score: ' + str(self.model.score2)
+        textpos = text.get_rect(centerx=center, centery=center)
+
+        # Options, two lines below the message
+        texts = [(text, textpos)]
+        for line, option in enumerate(["R: Play Again   M: Same Map", "U: Undo   Q: Quit"]):
+            option_text = options_font.render(option, 1, options_color)
+            texts.append((option_text, option_text.get_rect(centerx=center, centery=center + font_size*3//4 + line*font_size//2)))
+        return texts
 
+    def print_score(self, score=None):
+        """
+        Print the score of the model, or a given score, in the area below the field, clearing it first,
+        and return the rectangle of that area
+        """
         screen_size = self.screen.get_size()
-        font = pygame.font.Font(None, int(0.06*screen_size[0]))#20)  # How to pass font size?
-        background = pygame.Surface( ( screen_size[0], screen_size[1]-screen_size[0] ) )
-        background = background.convert()
+        score = self.model.score2 if score is None else score
+        if self.score_text is None or self.score_text_value != score:
+            font = self.font(int(0.06*screen_size[0]))
+            self.score_text = font.render('Score: ' + str(score), 1, (255, 255, 255, 1))
+            self.score_text_value = score
 
-        text = font.render(score_str, 1, (255, 255, 255, 1))
-        textpos = text.get_rect()
+        score_area = self.screen.fill(pygame.Color('black'), pygame.Rect(0, screen_size[0], screen_size[0], screen_size[1]-screen_size[0]))
+        textpos = self.score_text.get_rect()
         textpos.x = int(0.03*screen_size[0])
-        textpos.centery = sum(screen_size)/2
-        self.screen.blit(text, textpos)
+        textpos.centery = sum(screen_size)//2
+        self.screen.blit(self.score_text, textpos)
+        return score_area
+
+    def print_overlay(self):
+        """Print the overlay lines, if any, in the right half of the area below the field and return its rectangle"""
+        if self.overlay is None:
+            return None
+        screen_size = self.screen.get_size()
+        area = pygame.Rect(screen_size[0]//2, screen_size[0], screen_size[0] - screen_size[0]//2, screen_size[1] - screen_size[0])
+        font = self.font(max(area.height//2, 10))
+        self.screen.set_clip(area)
+        self.screen.fill(pygame.Color('black'), area)
+        for line_number, line in enumerate(self.overlay()):
+            text = font.render(line, 1, (160, 160, 160))
+            self.screen.blit(text, (area.x, area.y + line_number * font.get_linesize()))
+        self.screen.set_clip(None)
+        return area
+
+
+
+def check_projection(widths=(13, LINE_INDEX_WIDTH), chunked_widths=(20,), moves=40, seed=0):
+    """
+    Check get_slice against its reference get_slice_objects on seeded worlds, dense and chunked, for every
+    orientation of projection.planes() at the first, middle and last depth. The widths cover the plain
+    projection, the LineIndex one and the chunked one across two chunks per axis. Snakes move for a few ticks first so that every kind
+    of cell is in the worlds. Return the number of slices compared.
+    """
+    slices = 0
+    for dimensions, chunked in [(width, False) for width in widths] + [(width, True) for width in chunked_widths]:
+        model = GameModel(dimensions, seed, chunked=chunked)
+        rng = random.Random(seed)
+        for move in range(moves):
+            model.snake.change_direction(rng.choice(['up', 'left', 'down', 'right']))
+            model.update_snake()
+            model.check_collision()
+            if model.snake.dead:
+                break
+        view = GameView(model, None)
+        for up, right in projection.planes():
+            for depth in (0, dimensions // 2, dimensions - 1):
+                model.plane.orientation, model.plane.depth = ORIENTATION_INDEX[(up, right)], depth
+                expected = projection.image_from_objects(view.get_slice_objects())
+                assert np.array_equal(view.get_slice(), expected), (dimensions, chunked, up, right, depth)
+                slices += 1
+    return slices
+
+
+class ArrayGameView(GameView):
+    """
+    GameView that draws the whole slice with a single blit instead of one rectangle per cell.
+    The cell-kind image goes through an RGB palette array, is written to a one pixel per cell surface
+    with pygame.surfarray, then scaled up by square_size onto the screen.
+    """
+    def __init__(self, model, screen, square_size=10):
+        super(ArrayGameView, self).__init__(model, screen, square_size, incremental=False)
+        self.rgb_palette = np.array([[tuple(color)[:3] for color in colors] for colors in self.palette], dtype=np.uint8)
+        self.cells_surface = None #One pixel per cell of the slice
+        self.scaled_surface = None
+
+    def draw(self):
+        """Print the current grid slice to the screen"""
+        plane = self.get_slice()
+        dead = self.model.snake.dead
+        if self.cells_surface is None or self.cells_surface.get_size() != plane.shape:
+            self.cells_surface = pygame.Surface(plane.shape)
+            self.scaled_surface = pygame.Surface(tuple(self.square_size * size for size in plane.shape))
+
+        pygame.surfarray.blit_array(self.cells_surface, self.rgb_palette[int(dead)][plane])
+        pygame.transform.scale(self.cells_surface, self.scaled_surface.get_size(), self.scaled_surface)
+        self.screen.blit(self.scaled_surface, (0, 0))
+
+        self.print_score()
+
+        # Blit the death screen if the snake is dead
+        if dead:
+            self.print_death_text('Wasted', 64)
+
+        self.print_overlay()
+        pygame.display.update()
+
+
+class PipelinedGameView(ArrayGameView):
+    """
+    ArrayGameView whose slices are prepared by a SlicePipeline on a worker thread. draw queues the state of the model
+    and shows the newest frame the worker finished, so the screen lags the model by about one frame. Call present
+    between draws to show frames finished in the meantime.
+    """
+    def __init__(self, model, screen, square_size=10, queue_depth=2):
+        super(PipelinedGameView, self).__init__(model, screen, square_size)
+        self.pipeline = SlicePipeline(self.rgb_palette, queue_depth)
+
+    def draw(self):
+        """Queue a frame of the current state of the model and show the newest finished frame, if any"""
+        self.pipeline.submit(self.model)
+        self.present()
+
+    def present(self):
+        """Show the newest frame the worker finished since the last one shown. Return whether there was one"""
+        frame = self.pipeline.latest()
+        if frame is None:
+            return False
+        size = frame.rgb.shape[:2]
+        if self.cells_surface is None or self.cells_surface.get_size() != size:
+            self.cells_surface = pygame.Surface(size)
+            self.scaled_surface = pygame.Surface(tuple(self.square_size * length for length in size))
+
+        pygame.surfarray.blit_array(self.cells_surface, frame.rgb)
+        pygame.transform.scale(self.cells_surface, self.scaled_surface.get_size(), self.scaled_surface)
+        self.screen.blit(self.scaled_surface, (0, 0))
+
+        self.print_score(frame.score)
+        if frame.dead:
+            self.print_death_text('Wasted', 64)
+
+        self.print_overlay()
+        pygame.display.update()
+        return True
+
+    def close(self):
+        self.pipeline.close()
+
 
+if __name__ == '__main__':
+    print('projection check: %d slices matched their reference' % check_projection())